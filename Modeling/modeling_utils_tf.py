@@ -1,7 +1,12 @@
 import tensorflow as tf
 from tensorflow.python.client import device_lib
 
+from Processors.tfrecord_utils import tfrecord_dataset
+from Processors.processor_utils import PassageHandle, COMPACT_RECORD_VERSION
+
 QUERY_MAX_LEN = 64
+# number of examples of the msmarco train tfrecord, for the files written without metadata
+MSMARCO_TRAIN_EXAMPLES = 79561622
 
 def _extract_fn_train(data_record, max_seq_len):
     features = {
@@ -88,8 +93,9 @@ def _extract_fn_eval(data_record, max_seq_len):
       
     return (features, label_ids)
 
-def _get_dataset_train(dataset, batch_size, seq_length, num_skip=0):
-    dataset = dataset.map( lambda record : _extract_fn_train(record, seq_length)).prefetch(batch_size*1000)
+def _get_dataset_train(dataset, batch_size, seq_length, num_skip=0, num_examples=None, extract_fn=None):
+    extract_fn = extract_fn or (lambda record : _extract_fn_train(record, seq_length))
+    dataset = dataset.map(extract_fn).prefetch(batch_size*1000)
     #count = dataset.reduce(0, lambda x, _: x + 1)
     dataset = dataset.repeat()
     dataset = dataset.shuffle(buffer_size=1000, seed=42)
@@ -108,14 +114,18 @@ def _get_dataset_train(dataset, batch_size, seq_length, num_skip=0):
                     0
                 ),
                 drop_remainder=True)
-    return dataset, 79561622#count.numpy()
+    return dataset, MSMARCO_TRAIN_EXAMPLES if num_examples is None else num_examples
     
 
-def _get_dataset_eval(dataset, batch_size, seq_length, num_skip=0):
-    dataset = dataset.map( lambda record : _extract_fn_eval(record, seq_length)).prefetch(batch_size*1000)
+def _get_dataset_eval(dataset, batch_size, seq_length, num_skip=0, num_examples=None, extract_fn=None):
+    extract_fn = extract_fn or (lambda record : _extract_fn_eval(record, seq_length))
+    dataset = dataset.map(extract_fn).prefetch(batch_size*1000)
     if num_skip > 0:
         dataset = dataset.skip(num_skip)
-    count = dataset.reduce(0, lambda x, _: x + 1)
+    if num_examples is None:
+        count = dataset.reduce(0, lambda x, _: x + 1).numpy()
+    else:
+        count = max(0, num_examples - num_skip)
     dataset = dataset.padded_batch(
                 batch_size=batch_size,
                 padded_shapes=({
@@ -137,16 +147,27 @@ def _get_dataset_eval(dataset, batch_size, seq_length, num_skip=0):
                     }, 0
                 ),
                 drop_remainder=False)
-    return dataset, count.numpy()
+    return dataset, count
     
 
 def get_dataset(dataset_path, batch_size, seq_length, is_training_set=False, num_skip=0):
 
-    dataset = tf.data.TFRecordDataset([dataset_path])
+    # a TFRecord file or the manifest of its shards, the number of examples of the metadata
+    # written with the dataset (Processors.tfrecord_utils)
+    dataset, num_examples = tfrecord_dataset(dataset_path)
+    # the compact records (uint16 token ids, integer ids) are parsed by the handle that wrote them,
+    # it only reads the records here: no tokenizer
+    handle = PassageHandle(None, seq_length, QUERY_MAX_LEN)
+    version = handle._record_version(dataset)
+    extract_fn = None
     if is_training_set:
-        return _get_dataset_train(dataset, batch_size, seq_length, num_skip)
+        if version >= COMPACT_RECORD_VERSION:
+            extract_fn = lambda record : handle._extract_fn_train(record, version)
+        return _get_dataset_train(dataset, batch_size, seq_length, num_skip, num_examples, extract_fn)
     else:
-        return _get_dataset_eval(dataset, batch_size, seq_length, num_skip)
+        if version >= COMPACT_RECORD_VERSION:
+            extract_fn = lambda record : handle._extract_fn_eval(record, version)
+        return _get_dataset_eval(dataset, batch_size, seq_length, num_skip, num_examples, extract_fn)
 
 def get_available_gpus():
     local_device_protos = device_lib.list_local_devices()
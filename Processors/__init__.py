@@ -1,18 +1,10 @@
-try:
-    import absl.logging
-except ImportError:
-    pass
-else:
-    absl.logging.set_verbosity("info")
-    absl.logging.set_stderrthreshold("info")
-    absl.logging._warn_preinit_stderr = False
-
 import logging
-import tensorflow as tf
 import os
 
 logger = logging.getLogger(__name__)
 
+# tensorflow, spacy, nltk and bs4 are only imported when a handle, marker or
+# dataset function uses them, see import_utils.LazyImport
 from .marker_utils import get_marker
 from .processor_utils import PassageHandle, DocumentHandle, DocumentSplitterHandle
 from .msmarco_documents import  MsMarcoDocumentProcessor
@@ -0,0 +1,179 @@
+import logging
+import array
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+from .marker_utils import get_lexicon, get_nlp
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 'v1'
+STORE_FILES = ('offsets.npy', 'lengths.npy', 'starts.npy', 'ends.npy', 'stem_ids.npy')
+# bytes hashed at the start and at the end of the source file
+FINGERPRINT_BYTES = 1 << 20
+
+
+def _file_fingerprint(path):
+    """ size and sha1 of the first and last FINGERPRINT_BYTES of a file: a copy of the file has the
+        same fingerprint, another collection or a rewritten file (almost surely) not """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return {'path': os.path.abspath(path), 'size': size, 'sha1': digest.hexdigest()}
+
+
+def source_fingerprint(source_path=None, stem=None):
+    """ what the analysis of a store depends on: the source file of the docs (if given), the
+        spacy tokenizer and stopwords of get_nlp and the stem function of the lexicon """
+    import spacy
+    nlp = get_nlp()
+    if stem is None:
+        import nltk
+        stemmer = f'nltk.stem.porter.PorterStemmer {nltk.__version__}'
+    else:
+        module = getattr(stem, '__module__', None) or type(stem).__module__
+        stemmer = f'{module}.{getattr(stem, "__qualname__", type(stem).__name__)}'
+    stopwords = hashlib.sha1(' '.join(sorted(nlp.Defaults.stop_words)).encode('utf-8')).hexdigest()
+    return {
+        'source': _file_fingerprint(source_path) if source_path else None,
+        'tokenizer': f'spacy {spacy.__version__} {nlp.lang}',
+        'stopwords': stopwords,
+        'stemmer': stemmer,
+    }
+
+
+def build_analysis_store(store_dir, docs, fields, stem=None, log_every=10000, fingerprint=None):
+    """ Analyzes each document once and saves, for each of its fields, the character spans
+        (start, end) and stem ids of the tokens that can be marked. Stopwords, punctuation and
+        whitespace are implied by the gaps between the spans, the text itself is not stored.
+        docs: iterable of (doc_id, tuple of the field texts), duplicated doc ids are skipped.
+        The spans of the field f of the doc e are rows offsets[e * len(fields) + f] to
+        offsets[e * len(fields) + f + 1] of the starts, ends and stem_ids arrays.
+        fingerprint: source_fingerprint of the docs, checked by is_store_valid."""
+    start_time = time.time()
+    nlp = get_nlp()
+    lexicon = get_lexicon(stem)
+    stem_index, doc_ids, seen = {}, [], set()
+    offsets, lengths = array.array('q', [0]), array.array('q')
+    starts, ends, stem_ids = array.array('i'), array.array('i'), array.array('i')
+    for doc_id, texts in docs:
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        doc_ids.append(doc_id)
+        for text in texts:
+            for start, end, stem in lexicon.analyze(nlp(text)):
+                starts.append(start)
+                ends.append(end)
+                stem_ids.append(stem_index.setdefault(stem, len(stem_index)))
+            offsets.append(len(starts))
+            lengths.append(len(text))
+        if len(doc_ids) % log_every == 0:
+            print('Analyzed {} docs in {} sec'.format(len(doc_ids), int(time.time() - start_time)))
+
+    os.makedirs(store_dir, exist_ok=True)
+    for name, values, dtype in zip(STORE_FILES, (offsets, lengths, starts, ends, stem_ids),
+                                   (np.int64, np.int64, np.int32, np.int32, np.int32)):
+        np.save(os.path.join(store_dir, name), np.frombuffer(values, dtype=dtype))
+    stems = [None] * len(stem_index)
+    for stem, i in stem_index.items():
+        stems[i] = stem
+    # written last, a store without vocab.json is incomplete
+    with open(os.path.join(store_dir, 'vocab.json'), 'w') as writer:
+        json.dump({'version': STORE_VERSION, 'fields': list(fields), 'fingerprint': fingerprint or source_fingerprint(stem=stem),
+                   'doc_ids': doc_ids, 'stems': stems}, writer)
+    print('Analysis store with {} docs, {} spans built in {} sec'.format(
+        len(doc_ids), len(starts), int(time.time() - start_time)))
+    return store_dir
+
+
+def is_store_valid(store_dir, fields, fingerprint=None):
+    """ True if the store of store_dir is complete and was built with the same fields and
+        source_fingerprint (default: the analyzer of the process, any source) """
+    path = os.path.join(store_dir, 'vocab.json')
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        vocab = json.load(f)
+    if vocab.get('version') != STORE_VERSION or vocab.get('fields') != list(fields):
+        return False
+    fingerprint = fingerprint or source_fingerprint()
+    stored = vocab.get('fingerprint')
+    if stored is not None and fingerprint['source'] is None:
+        # the source file is unknown to the caller, only the analyzer is checked
+        stored = dict(stored, source=None)
+    if stored != fingerprint:
+        logger.warning('analysis store %s was built from another source or analyzer: %s, expected %s', store_dir, stored, fingerprint)
+        return False
+    return True
+
+
+def open_analysis_store(store_dir, docs, fields, stem=None, source_path=None):
+    """ opens the store of store_dir, builds it from docs first if it does not exist or if it was
+        built from another source file (source_path, the file docs are read from) or analyzer """
+    fingerprint = source_fingerprint(source_path, stem)
+    if not is_store_valid(store_dir, fields, fingerprint):
+        print('Building analysis store...')
+        build_analysis_store(store_dir, docs, fields, stem, fingerprint=fingerprint)
+    return AnalysisStore(store_dir)
+
+
+class AnalysisStore(object):
+    """ Read-only per document analysis of build_analysis_store, the arrays are memory mapped.
+        Marking a (query, doc) pair is a set membership of the doc stem ids in the query stem ids."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'vocab.json')) as f:
+            vocab = json.load(f)
+        self.fields = vocab['fields']
+        self.stems = vocab['stems']
+        self.stem_index = {stem: i for i, stem in enumerate(self.stems)}
+        self.doc_index = {doc_id: e for e, doc_id in enumerate(vocab['doc_ids'])}
+        self._field_index = {field: f for f, field in enumerate(self.fields)}
+        self.offsets, self.lengths, self.starts, self.ends, self.stem_ids = [
+            np.load(os.path.join(store_dir, name), mmap_mode='r') for name in STORE_FILES]
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_index
+
+    def __len__(self):
+        return len(self.doc_index)
+
+    def query_ids(self, stems):
+        """ the store ids of the query stems, the stems not in the store can not match """
+        return np.array([self.stem_index[stem] for stem in stems if stem in self.stem_index], dtype=np.int32)
+
+    def _row(self, doc_id, field, text):
+        e = self.doc_index.get(doc_id)
+        f = self._field_index.get(field)
+        if e is None or f is None:
+            return None
+        row = e * len(self.fields) + f
+        if self.lengths[row] != len(text):
+            return None
+        return row
+
+    def has(self, doc_id, field, text):
+        """ True if the field of doc_id was analyzed from a text of the same length """
+        return self._row(doc_id, field, text) is not None
+
+    def match(self, doc_id, field, text, query_ids):
+        """ returns the (start, end, stem) spans of the field of doc_id whose stem id is in query_ids,
+            or None if the doc is not in the store or was analyzed from a different text """
+        row = self._row(doc_id, field, text)
+        if row is None:
+            return None
+        a, b = self.offsets[row], self.offsets[row + 1]
+        ids = self.stem_ids[a:b]
+        found = np.flatnonzero(np.isin(ids, query_ids))
+        stems = self.stems
+        return [(start, end, stems[i]) for start, end, i in zip(
+            self.starts[a:b][found].tolist(), self.ends[a:b][found].tolist(), ids[found].tolist())]
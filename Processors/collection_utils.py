@@ -0,0 +1,164 @@
+import logging
+import mmap
+import os
+import tempfile
+import time
+from collections.abc import Mapping
+
+from .reader_utils import is_compressed
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 'v1'
+
+
+def get_index_path(collection_path):
+    """ the offset index is stored next to the collection tsv file """
+    return collection_path + INDEX_SUFFIX
+
+
+def _index_header(collection_path, num_docs):
+    stat = os.stat(collection_path)
+    return f'#collection_index\t{INDEX_VERSION}\t{stat.st_size}\t{stat.st_mtime_ns}\t{num_docs}\n'
+
+
+def _is_index_valid(collection_path, index_path):
+    """ an index is valid if it was built from the current version of the collection file """
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, 'rb') as f:
+        header = f.readline().decode('utf-8').rstrip('\n').split('\t')
+    if len(header) != 5 or header[0] != '#collection_index' or header[1] != INDEX_VERSION:
+        return False
+    stat = os.stat(collection_path)
+    return header[2] == str(stat.st_size) and header[3] == str(stat.st_mtime_ns)
+
+
+def build_collection_index(collection_path, index_path=None):
+    """ Builds a doc_id -> byte offset index of a tsv collection (doc_id first column).
+        The entries are sorted by doc_id so lookups are a binary search on the mmaped index file."""
+    index_path = index_path or get_index_path(collection_path)
+    start_time = time.time()
+    entries = []
+    offset = 0
+    with open(collection_path, 'rb') as f:
+        for i, line in enumerate(f):
+            doc_id = line.split(b'\t', 1)[0]
+            entries.append((doc_id, offset))
+            offset += len(line)
+            if i % 1000000 == 0:
+                print('Indexing collection, doc {}'.format(i))
+    entries.sort()
+
+    # a temp file of its own: concurrent builds of the same index (jobs started together) each publish a whole index
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(index_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(index_path)))
+    try:
+        with os.fdopen(fd, 'wb') as writer:
+            writer.write(_index_header(collection_path, len(entries)).encode('utf-8'))
+            for doc_id, offset in entries:
+                writer.write(doc_id + b'\t' + str(offset).encode() + b'\n')
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    print('Collection index with {} docs built in {} sec'.format(len(entries), int(time.time() - start_time)))
+    return index_path
+
+
+class CollectionIndex(Mapping):
+    """ Read-only dict-like view of a tsv collection: key: doc id, value: parse_fn(line).
+        Documents are fetched lazily through the memory mapped collection and offset index,
+        so the memory used does not grow with the collection size."""
+
+    def __init__(self, collection_path, parse_fn, index_path=None):
+        self.collection_path = collection_path
+        self.parse_fn = parse_fn
+        self.index_path = index_path or get_index_path(collection_path)
+        if is_compressed(collection_path):
+            raise ValueError('the collection index needs an uncompressed collection: ' + collection_path)
+        if not _is_index_valid(self.collection_path, self.index_path):
+            print('Building collection index...')
+            build_collection_index(self.collection_path, self.index_path)
+        self._open()
+
+    def _open(self):
+        self._index_file = open(self.index_path, 'rb')
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data_start = self._index.find(b'\n') + 1
+        self._num_docs = int(self._index[:self._data_start].decode('utf-8').rstrip('\n').split('\t')[4])
+        self._collection_file = open(self.collection_path, 'rb')
+        if os.path.getsize(self.collection_path) > 0:
+            self._collection = mmap.mmap(self._collection_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._collection = b''
+
+    def close(self):
+        for m in (self._index, self._collection):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self._index_file.close()
+        self._collection_file.close()
+
+    def __getstate__(self):
+        # mmaps can't be pickled, they are reopened in the worker process
+        return {'collection_path': self.collection_path,
+                'parse_fn': self.parse_fn,
+                'index_path': self.index_path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def _offset(self, doc_id):
+        """ binary search of doc_id in the sorted index, returns the byte offset or None """
+        key = doc_id.encode('utf-8')
+        index = self._index
+        lo, hi = self._data_start, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = max(index.rfind(b'\n', 0, mid) + 1, self._data_start)
+            end = index.find(b'\n', start)
+            tab = index.find(b'\t', start, end)
+            line_key = index[start:tab]
+            if line_key == key:
+                return int(index[tab + 1:end])
+            if line_key < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def _read_line(self, offset):
+        end = self._collection.find(b'\n', offset)
+        if end < 0:
+            end = len(self._collection)
+        return self._collection[offset:end].decode('utf-8')
+
+    def __getitem__(self, doc_id):
+        offset = self._offset(doc_id)
+        if offset is None:
+            raise KeyError(doc_id)
+        return self.parse_fn(self._read_line(offset))[1]
+
+    def __contains__(self, doc_id):
+        return self._offset(doc_id) is not None
+
+    def __len__(self):
+        return self._num_docs
+
+    def __iter__(self):
+        """ iterates the doc ids in the collection file order """
+        with open(self.collection_path, 'rb') as f:
+            for line in f:
+                yield line.split(b'\t', 1)[0].decode('utf-8')
+
+
+def get_run_doc_ids(data, num_eval_docs):
+    """ Returns the set of candidate doc ids of a merged run after the num_eval_docs cut """
+    doc_ids = set()
+    for query_id in data:
+        _, _, doc_titles = data[query_id]
+        doc_ids.update(doc_titles[:num_eval_docs])
+    return doc_ids
@@ -0,0 +1,48 @@
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LazyImport(object):
+    """ Proxy of a module imported on the first access to one of its attributes,
+        so importing Processors does not import tensorflow for the tsv only scripts.
+        on_import(module) is called once, after the module is imported. """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._on_import is not None:
+                self._on_import(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported'
+        return f'<lazy module {self._name} ({state})>'
+
+
+def _configure_absl(module):
+    """ absl is imported by tensorflow, its logs go through the python logging at info level """
+    try:
+        import absl.logging
+    except ImportError:
+        pass
+    else:
+        absl.logging.set_verbosity("info")
+        absl.logging.set_stderrthreshold("info")
+        absl.logging._warn_preinit_stderr = False
+
+
+tf = LazyImport('tensorflow', on_import=_configure_absl)
@@ -1,435 +1,277 @@
 
 import argparse
-import nltk
-from nltk.stem.porter import PorterStemmer
 import time
-import tensorflow as tf
-import spacy as sp
-from spacy.tokens import Doc
-import copy
 
 STRATEGIES = ('un_mark_pass', 'un_mark_pair', 'mu_mark_pass', 'mu_mark_pair', 'base')
 
-def get_marker(strategy):
+def get_marker(strategy, store=None):
     strategy = strategy.lower()
     if strategy not in STRATEGIES:
         raise ValueError('strategy must be in ', STRATEGIES)
     if strategy == 'un_mark_pass':
-        return UnPassMarker()
+        return UnPassMarker(store=store)
     if strategy == 'un_mark_pair':
-        return UnPairMarker()
+        return UnPairMarker(store=store)
     if strategy == 'mu_mark_pass':
-        return MuPassMarker()
+        return MuPassMarker(store=store)
     if strategy == 'mu_mark_pair':
-        return MuPairMarker()
+        return MuPairMarker(store=store)
     if strategy == 'base':
-        return BaseMarker()
+        return BaseMarker(store=store)
+
+def get_marker_strings(strategy, num_terms):
+    """ the distinct prefixes / suffixes a strategy writes for queries of up to num_terms stems """
+    marker = get_marker(strategy)
+    if isinstance(marker, BaseMarker):
+        return []
+    strings = []
+    for q_i in range(num_terms):
+        for mark in marker._tag(q_i):
+            if mark not in strings:
+                strings.append(mark)
+    return strings
+
+_nlp = None
+
+def get_nlp():
+    """ returns the tokenizer-only english pipeline shared by all the markers of the process,
+        created on first use. The markers only use the tokens and their is_stop / is_punct lexical
+        attributes: the tokenizer and the lexical attributes of en_core_web_sm are the english
+        defaults of spacy.blank('en'), without loading the model package. """
+    global _nlp
+    if _nlp is None:
+        import spacy as sp
+        _nlp = sp.blank('en')
+        _nlp.max_length = 2100000
+    return _nlp
+
+_lexicons = {}
+_porter_stem = None
+
+def get_lexicon(stem=None):
+    """ returns the Lexicon of the stem function shared by all the markers of the process """
+    global _porter_stem
+    if stem is None:
+        if _porter_stem is None:
+            from nltk.stem.porter import PorterStemmer
+            _porter_stem = PorterStemmer().stem
+        stem = _porter_stem
+    if stem not in _lexicons:
+        _lexicons[stem] = Lexicon(stem)
+    return _lexicons[stem]
+
+class Lexicon(object):
+    """ memoizes the analysis of a token text: its stem, or None for stopwords and punctuation
+        (lexical attributes of spacy, they only depend on the text of the token) """
+
+    def __init__(self, stem):
+        self.stem = stem
+        self.stems = {}
+
+    def analyze(self, doc):
+        """ returns the (start, end, stem) character spans of the tokens of a spacy Doc that can be marked """
+        stems = self.stems
+        spans = []
+        for token in doc:
+            text = token.text
+            try:
+                stem = stems[text]
+            except KeyError:
+                stem = None if (token.is_punct or token.is_stop) else self.stem(text.lower())
+                stems[text] = stem
+            if stem is not None:
+                spans.append((token.idx, token.idx + len(text), stem))
+        return spans
+
+def find_marks(spans, tags):
+    """ returns the (start, end, prefix, suffix) marks of the spans whose stem is in tags,
+        and the set of matched stems """
+    marks = []
+    matched = set()
+    for start, end, stem in spans:
+        tag = tags.get(stem)
+        if tag is not None:
+            marks.append((start, end, tag[0], tag[1]))
+            matched.add(stem)
+    return marks, matched
+
+def apply_marks(text, marks):
+    """ surrounds the spans of the marks with their prefix and suffix """
+    if not marks:
+        return text
+    pieces = []
+    last = 0
+    for start, end, prefix, suffix in marks:
+        pieces += (text[last:start], prefix, text[start:end], suffix)
+        last = end
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+class MarkedText(object):
+    """ a clean text and its (start, end, prefix, suffix) marks. The marked string is built on first
+        use (str, format), the handles can instead tokenize the clean text and insert the token ids
+        of the marks (processor_utils.MarkEncoder) """
+    __slots__ = ('text', 'marks', '_marked')
+
+    def __init__(self, text, marks=()):
+        self.text = text
+        self.marks = marks
+        self._marked = None
+
+    def __str__(self):
+        if self._marked is None:
+            self._marked = apply_marks(self.text, self.marks)
+        return self._marked
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def __repr__(self):
+        return f'MarkedText({str(self)!r})'
 
 class Marker(object):
+    """ marks the terms of a passage (title, doc) having the stem of a query term,
+        pair strategies also mark the matched terms in the query """
+    mark_query = False
+
+    def __init__(self, stem=None, store=None):
+        self._stem = stem
+        self.query_spans = []
+        self.tags = {}
+        self.title = None
+        self.marked_title = ''
+        self.title_stems = set()
+        self._batch_spans = {}
+        self.set_store(store)
+
+    @property
+    def nlp(self):
+        return get_nlp()
+
+    @property
+    def lexicon(self):
+        return get_lexicon(self._stem)
+
+    @property
+    def stem(self):
+        return self.lexicon.stem
+
+    def set_store(self, store):
+        """ marks the docs of an AnalysisStore (analysis_utils) from their stored analysis """
+        self.store = store
+        self.query = None
 
-    def __init__(self, stem=None):
-        self.nlp = sp.load("en_core_web_sm", disable=['parser', 'tagger', 'ner'])
-        self.nlp.max_length = 2100000
-        if stem:
-            self.stem = stem
-        else:
-            porter = PorterStemmer()
-            self.stem = porter.stem
     def mark(self, *args, **kwds):
-        """ mark """
+        """ mark, the doc_id keyword selects the analysis of the doc in the store.
+            with marked_text=True the texts are returned as MarkedText instead of str """
+        doc_id = kwds.get('doc_id')
         if len(args) == 2 :
-            return self._mark(args[0], args[1])
+            marked = self._mark(args[0], args[1], doc_id)
         elif len(args) == 3:
-            return self._mark_with_title(args[0], args[1], args[2])
+            marked = self._mark_with_title(args[0], args[1], args[2], doc_id)
         else :
             return None
-    
-    def _mark_with_title(self, query, title, doc):
-        """ mark the pair of query (title,doc) or the (title,doc) only depending on the strategy"""
+        if kwds.get('marked_text'):
+            return marked
+        return tuple(str(text) for text in marked)
+
+    def mark_batch(self, items, doc_ids=None, batch_size=256, n_process=1, marked_text=False):
+        """ marks a list of (query, doc) or (query, title, doc) tuples, the texts that are not in the
+            store are tokenized together with nlp.pipe. Returns the marked tuples in the input order.
+            n_process > 1 starts a pool of processes for this call only: to mark many batches in
+            parallel use processor_utils.imap_mark_batches, which keeps one pool."""
+        items = list(items)
+        doc_ids = [None] * len(items) if doc_ids is None else list(doc_ids)
+        texts = set()
+        for item, doc_id in zip(items, doc_ids):
+            texts.add(item[0])
+            fields = ('title', 'doc') if len(item) == 3 else ('doc',)
+            for field, text in zip(fields, item[1:]):
+                if self.store is None or not self.store.has(doc_id, field, text):
+                    texts.add(text)
+        texts = list(texts)
+        for text, doc in zip(texts, self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)):
+            self._batch_spans[text] = self.lexicon.analyze(doc)
+        try:
+            return [self.mark(*item, doc_id=doc_id, marked_text=marked_text) for item, doc_id in zip(items, doc_ids)]
+        finally:
+            self._batch_spans = {}
+
+    def _tag(self, q_i):
+        """ (prefix, suffix) of the terms matching the q_i-th distinct query stem """
         raise NotImplementedError()
 
-    def _mark(self, query, doc):
+    def _analyze(self, text):
+        spans = self._batch_spans.get(text)
+        if spans is None:
+            spans = self.lexicon.analyze(self.nlp(text))
+        return spans
+
+    def _set_query(self, query):
+        if query != self.query:
+            self.query = query
+            # the marks of the cached title depend on the query
+            self.title = None
+            self.query_spans = self._analyze(query)
+            self.tags = dict()
+            for _, _, stem in self.query_spans:
+                if stem not in self.tags:
+                    self.tags[stem] = self._tag(len(self.tags))
+            if self.store is not None:
+                self.query_ids = self.store.query_ids(self.tags)
+
+    def _mark_field(self, text, doc_id, field):
+        """ marks the text of a field of the doc, returns the MarkedText and the matched stems """
+        spans = None
+        if self.store is not None and doc_id is not None:
+            spans = self.store.match(doc_id, field, text, self.query_ids)
+        if spans is None:
+            spans = self._analyze(text)
+        marks, matched = find_marks(spans, self.tags)
+        return MarkedText(text, marks), matched
+
+    def _mark_query(self, query, matched):
+        if not self.mark_query:
+            return MarkedText(query)
+        return MarkedText(query, find_marks(self.query_spans, {stem: self.tags[stem] for stem in matched})[0])
+
+    def _mark_with_title(self, query, title, doc, doc_id=None):
+        """ mark the pair of query (title,doc) or the (title,doc) only depending on the strategy"""
+        self._set_query(query)
+        if title != self.title:
+            self.title = title
+            self.marked_title, self.title_stems = self._mark_field(title, doc_id, 'title')
+        marked_doc, matched = self._mark_field(doc, doc_id, 'doc')
+        return self._mark_query(query, self.title_stems | matched), self.marked_title, marked_doc
+
+    def _mark(self, query, doc, doc_id=None):
         """ mark the pair or the doc only depending on the strategy"""
-        raise NotImplementedError()
+        self._set_query(query)
+        marked_doc, matched = self._mark_field(doc, doc_id, 'doc')
+        return self._mark_query(query, matched), marked_doc
 
 class BaseMarker(Marker):
 
-    def _mark(self,query,doc):
+    def mark_batch(self, items, doc_ids=None, batch_size=256, n_process=1, marked_text=False):
+        return [tuple(item) for item in items]
+
+    def _mark(self,query,doc,doc_id=None):
         return query,doc
-    def _mark_with_title(self, query, title, doc):
+    def _mark_with_title(self, query, title, doc, doc_id=None):
         return query, title ,doc
 
 class UnPassMarker(Marker):
 
-    def __init__(self, stem=None):
-        super(UnPassMarker, self).__init__(stem)
-        self.query = ''
-        self.stems = set()
-        self.title = ''
-        self.t = None
-        self.title_terms = []
-
-    def _mark(self, query, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            q = self.nlp(query)
-            self.stems = set()
-            for token in q:
-                if not (token.is_punct or token.is_stop):
-                    self.stems.add(self.stem(token.text.lower()))
-
-        marked_doc = []
-        
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stems:
-                    if q_stem == stem:
-                        marked_doc.pop()
-                        marked_doc.append(f"#{term.text}#")
-                        break                   
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return query, ''.join(token.text_with_ws for token in doc)
-    
-    def _mark_with_title(self, query, title, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            q = self.nlp(query)
-            self.stems = set()
-            for token in q:
-                if not (token.is_punct or token.is_stop):
-                    self.stems.add(self.stem(token.text.lower()))
-        if title != self.title:
-            self.title = title
-            self.t = self.nlp(title)
-            self.title_terms = []
-            for i,term in enumerate(self.t):
-                self.title_terms.append(term.text)
-                if not (term.is_punct or term.is_stop):
-                    stem = self.stem(term.text.lower())
-                    for q_stem in self.stems:
-                        if q_stem == stem:
-                            self.title_terms.pop()
-                            self.title_terms.append(f"#{term.text}#")
-                            break 
-        marked_doc = []
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stems:
-                    if q_stem == stem:
-                        marked_doc.pop()
-                        marked_doc.append(f"#{term.text}#")
-                        break 
-        title = Doc(self.nlp.vocab, words=self.title_terms, spaces=[token.whitespace_ for token in self.t])                  
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return query, ''.join(token.text_with_ws for token in title), ''.join(token.text_with_ws for token in doc)
-
-class UnPairMarker(Marker):
-
-    def __init__(self, stem=None):
-        super(UnPairMarker, self).__init__(stem)
-        self.query = ''
-        self.stems = set()
-        self.query_terms = []
-        self.q = None
-        self.title = ''
-        self.t = None
-        self.title_terms = []
-        self.mark_stem = dict()
-    
-    def _set_query_terms(self,terms_list):
-        self.query_terms = []
-        self.query_terms = copy.deepcopy(terms_list)
-
-    def _get_query_terms(self):
-        return copy.deepcopy(self.query_terms)
-
-    def _mark(self, query, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            self.q = self.nlp(query)
-            self.query_terms = []
-            self.stems = dict()
-            for i,token in enumerate(self.q):
-                self.query_terms.append(token.text)
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    self.stems[stem] = self.stems[stem]+[i] if stem in self.stems else [i]
-        marked_q = self._get_query_terms()
-        
-        mark = dict ()
-        marked_doc = []
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stems:
-                    if q_stem == stem:
-                        mark[q_stem] = True 
-                        marked_doc.pop()
-                        marked_doc.append(f"#{term.text}#")  
-                        break              
-                
-        for stem in mark:
-            for i in self.stems[stem]:
-                marked_q[i] = f"#{marked_q[i]}#" 
-
-        qu = Doc(self.nlp.vocab, words=marked_q, spaces= [token.whitespace_ for token in self.q])
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return ''.join(token.text_with_ws for token in qu), ''.join(token.text_with_ws for token in doc)
-
-    def _mark_with_title(self, query, title, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            self.q = self.nlp(query)
-            self.query_terms = []
-            self.stems = dict()
-            for i,token in enumerate(self.q):
-                self.query_terms.append(token.text)
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    self.stems[stem] = self.stems[stem]+[i] if stem in self.stems else [i]
-        marked_q = self._get_query_terms()
+    def _tag(self, q_i):
+        return '#', '#'
 
-        if title != self.title:
-            self.title = title
-            self.t = self.nlp(title)
-            self.title_terms = []
-            self.mark_stem = dict()
-            for i,term in enumerate(self.t):
-                self.title_terms.append(term.text)
-                if not (term.is_punct or term.is_stop):
-                    stem = self.stem(term.text.lower())
-                    for q_stem in self.stems:
-                        if q_stem == stem:
-                            self.mark_stem[q_stem] = True
-                            self.title_terms.pop()
-                            self.title_terms.append(f"#{term.text}#")
-                            break 
-        mark = copy.deepcopy(self.mark_stem)
-        marked_doc = []
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stems:
-                    if q_stem == stem:
-                        mark[q_stem] = True 
-                        marked_doc.pop()
-                        marked_doc.append(f"#{term.text}#")  
-                        break              
-                
-        for stem in mark:
-            for i in self.stems[stem]:
-                marked_q[i] = f"#{marked_q[i]}#" 
-
-        title = Doc(self.nlp.vocab, words=self.title_terms, spaces=[token.whitespace_ for token in self.t])
-        qu = Doc(self.nlp.vocab, words=marked_q, spaces= [token.whitespace_ for token in self.q])
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return ''.join(token.text_with_ws for token in qu), ''.join(token.text_with_ws for token in title), ''.join(token.text_with_ws for token in doc)
+class UnPairMarker(UnPassMarker):
+    mark_query = True
 
 class MuPassMarker(Marker):
-    def __init__(self, stem=None):
-        super(MuPassMarker, self).__init__(stem)
-        self.query = ''
-        self.stem_to_id = dict()
-        self.title = ''
-        self.t = None
-        self.title_terms = []
-    
-    def _mark(self, query, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            q = self.nlp(query)
-            self.stem_to_id = dict()
-            q_i = 0
-            for token in q:
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    if stem not in self.stem_to_id :
-                        self.stem_to_id[stem] = q_i
-                        q_i +=1
-
-        marked_doc = []
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stem_to_id:
-                    if q_stem == stem:
-                        q_i = self.stem_to_id[stem]
-                        marked_doc.pop()
-                        marked_doc.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                        break                   
-        
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return query, ''.join(token.text_with_ws for token in doc)
-
-    def _mark_with_title(self, query, title, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            q = self.nlp(query)
-            self.stem_to_id = dict()
-            q_i = 0
-            for token in q:
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    if stem not in self.stem_to_id :
-                        self.stem_to_id[stem] = q_i
-                        q_i +=1
-        if title != self.title:
-            self.title = title
-            self.t = self.nlp(title)
-            self.title_terms = []
-            for i,term in enumerate(self.t):
-                self.title_terms.append(term.text)
-                if not (term.is_punct or term.is_stop):
-                    stem = self.stem(term.text.lower())
-                    for q_stem in self.stem_to_id:
-                        if q_stem == stem:
-                            q_i = self.stem_to_id[stem]
-                            self.title_terms.pop()
-                            self.title_terms.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                            break  
-        marked_doc = []
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stem_to_id:
-                    if q_stem == stem:
-                        q_i = self.stem_to_id[stem]
-                        marked_doc.pop()
-                        marked_doc.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                        break                   
-        tit = Doc(self.nlp.vocab, words=self.title_terms, spaces=[token.whitespace_ for token in self.t])
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return query, ''.join(token.text_with_ws for token in tit), ''.join(token.text_with_ws for token in doc)
-
-class MuPairMarker(Marker):
-    def __init__(self, stem=None):
-        super(MuPairMarker, self).__init__(stem)
-        self.query = ''
-        self.stem_to_id = dict()
-        self.id_to_pos = dict()
-        self.q = None
-        self.query_terms = []
-        self.title = ''
-        self.t = None
-        self.title_terms = []
-        self.mark_stem = set()
-    
-    def _get_query_terms(self):
-        return copy.deepcopy(self.query_terms)
-    
-    def _mark(self, query, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            self.q = self.nlp(query)
-            self.stem_to_id = dict()
-            self.id_to_pos = dict()
-            self.query_terms = []
-            q_i = 0
-            for pos, token in enumerate(self.q):
-                self.query_terms.append(token.text)
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    if stem in self.stem_to_id :
-                        i = self.stem_to_id[stem]
-                        self.id_to_pos[i]= self.id_to_pos[i]+[pos]
-                    if stem not in self.stem_to_id :
-                        self.stem_to_id[stem] = q_i
-                        self.id_to_pos[q_i] = [pos]
-                        q_i +=1
-        marked_q = self._get_query_terms()
-        mark = set()
-        marked_doc = []      
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stem_to_id:
-                    if q_stem == stem:
-                        q_i = self.stem_to_id[stem]
-                        mark.add(q_i)
-                        marked_doc.pop()
-                        marked_doc.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                        break  
-        for i in mark:
-            for pos in self.id_to_pos[i]:
-                marked_q[pos] = f"[e{i}]{marked_q[pos]}[\e{i}]"
-
-        qu = Doc(self.nlp.vocab, words=marked_q, spaces= [token.whitespace_ for token in self.q])    
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return ''.join(token.text_with_ws for token in qu),''.join(token.text_with_ws for token in doc)
-    
-    def _mark_with_title(self, query, title, doc):
-        d = self.nlp(doc)
-        if query != self.query:
-            self.query = query
-            self.q = self.nlp(query)
-            self.stem_to_id = dict()
-            self.id_to_pos = dict()
-            self.query_terms = []
-            q_i = 0
-            for pos, token in enumerate(self.q):
-                self.query_terms.append(token.text)
-                if not (token.is_punct or token.is_stop):
-                    stem = self.stem(token.text.lower())
-                    if stem in self.stem_to_id :
-                        i = self.stem_to_id[stem]
-                        self.id_to_pos[i]= self.id_to_pos[i]+[pos]
-                    if stem not in self.stem_to_id :
-                        self.stem_to_id[stem] = q_i
-                        self.id_to_pos[q_i] = [pos]
-                        q_i +=1
-        marked_q = self._get_query_terms()
-        if title != self.title:
-            self.title = title
-            self.t = self.nlp(title)
-            self.title_terms = []
-            self.mark_stem = set()
-            for i,term in enumerate(self.t):
-                self.title_terms.append(term.text)
-                if not (term.is_punct or term.is_stop):
-                    stem = self.stem(term.text.lower())
-                    for q_stem in self.stem_to_id:
-                        if q_stem == stem:
-                            q_i = self.stem_to_id[stem]
-                            self.mark_stem.add(q_i)
-                            self.title_terms.pop()
-                            self.title_terms.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                            break 
-        mark = copy.deepcopy(self.mark_stem)
-        marked_doc = []      
-        for i,term in enumerate(d):
-            marked_doc.append(term.text)
-            if not (term.is_punct or term.is_stop):
-                stem = self.stem(term.text.lower())
-                for q_stem in self.stem_to_id:
-                    if q_stem == stem:
-                        q_i = self.stem_to_id[stem]
-                        mark.add(q_i)
-                        marked_doc.pop()
-                        marked_doc.append(f"[e{q_i}]{term.text}[\e{q_i}]")
-                        break  
-        for i in mark:
-            for pos in self.id_to_pos[i]:
-                marked_q[pos] = f"[e{i}]{marked_q[pos]}[\e{i}]"
-
-        qu = Doc(self.nlp.vocab, words=marked_q, spaces= [token.whitespace_ for token in self.q]) 
-        tit = Doc(self.nlp.vocab, words=self.title_terms, spaces=[token.whitespace_ for token in self.t])   
-        doc = Doc(self.nlp.vocab, words=marked_doc, spaces=[token.whitespace_ for token in d])
-        return ''.join(token.text_with_ws for token in qu), ''.join(token.text_with_ws for token in tit), ''.join(token.text_with_ws for token in doc)
 
+    def _tag(self, q_i):
+        return f"[e{q_i}]", f"[\\e{q_i}]"
 
+class MuPairMarker(MuPassMarker):
+    mark_query = True
@@ -1,14 +1,23 @@
 import logging
 import collections
-import tensorflow as tf
-import os , time
-import spacy as sp
+import os
 
-from .processor_utils import DataProcessor, strip_html_xml_tags, clean_text
+from .processor_utils import DataProcessor, convert_document_dataset, imap_mark_batches, query_examples
+from .collection_utils import CollectionIndex, get_run_doc_ids
+from .run_utils import Run
+from .reader_utils import TsvSchema, load_qrels, load_queries, load_collection, iter_lines_with_progress, iter_group_batches
 from .marker_utils import get_marker
+from .analysis_utils import open_analysis_store
+from .tfrecord_utils import open_tfrecord_writer
 
 logger = logging.getLogger(__name__)
 
+# column layouts of the msmarco document files, the trec qrels are blank space separated
+QRELS_SCHEMA = TsvSchema(('query_id', 'iteration', 'doc_id', 'relevance'), sep=None)
+QUERIES_SCHEMA = TsvSchema(('query_id', 'query'))
+RUN_SCHEMA = TsvSchema(('query_id', 'doc_id', 'rank', '_'))
+COLLECTION_SCHEMA = TsvSchema(('doc_id', 'url', 'title', 'text'), value_columns=('title', 'text'))
+
 
 # util functions for msmarco passage dataset
 """ the collection tsv file must be preprocessed to fill the NaN titles with a '.' 
@@ -20,132 +29,34 @@ def convert_eval_dataset(output_folder,
                         collection_path, 
                         set_name,
                         num_eval_docs,
-                        sentence_level=True):
+                        sentence_level=True,
+                        index_collection=False,
+                        run_docs_only=False,
+                        clean_cache_size=10000,
+                        num_workers=1):
     print('Begin...')
     if not os.path.exists(output_folder):
             os.mkdir(output_folder)
 
-    qrels = _load_qrels(qrels_path, set_name)
+    qrels = load_qrels(qrels_path, QRELS_SCHEMA, relevance_threshold=1)
 
-    queries = _load_queries(path=queries_path)
-    run = _load_run(path=run_path)
+    queries = load_queries(queries_path, QUERIES_SCHEMA)
+    run = Run.from_file(run_path, RUN_SCHEMA, max_depth=num_eval_docs)
     data = _merge(qrels=qrels, run=run, queries=queries)
 
     print('Loading Collection...')
-    collection = _load_collection(collection_path)
+    if index_collection:
+        collection = CollectionIndex(collection_path, COLLECTION_SCHEMA.parse_document)
+    elif run_docs_only:
+        collection = load_collection(collection_path, COLLECTION_SCHEMA, get_run_doc_ids(data, num_eval_docs), num_workers)
+    else:
+        collection = load_collection(collection_path, COLLECTION_SCHEMA, num_workers=num_workers)
 
     print('Converting to TFRecord...')
-    _convert_dataset(data, collection, set_name, num_eval_docs, output_folder)
+    convert_document_dataset(data, collection, set_name, num_eval_docs, output_folder, clean_cache_size=clean_cache_size, num_workers=num_workers)
 
     print('Done!')
 
-def _convert_dataset(data, 
-                        collection, 
-                        set_name, 
-                        num_eval_docs, 
-                        output_folder,
-                        sentence_level = True):
-
-    output_path = output_folder + f'/run_{set_name}_doc.tsv'
-    start_time = time.time()
-    random_title = list(collection.keys())[0]
-    if sentence_level:
-        sent_writer = open(output_folder + f'/run_{set_name}_sentence.tsv', 'w')
-        nlp = sp.load("en_core_web_sm", disable=['parser', 'tagger', 'ner'])
-        nlp.max_length = 2100000
-        nlp.add_pipe(nlp.create_pipe('sentencizer'))
-
-    with open(output_path, 'w') as doc_writer:
-        for idx, query_id in enumerate(data):
-                query, qrels, doc_titles = data[query_id]
-
-                clean_query = clean_text(query)
-
-                doc_titles = doc_titles[:num_eval_docs]
-
-                # Add fake docs so we always have max_docs per query.
-                doc_titles += max(0, num_eval_docs - len(doc_titles)) * [random_title]
-
-                labels = [
-                    1 if doc_title in qrels else 0 
-                    for doc_title in doc_titles
-                ]
-
-                len_gt_query = len(qrels)
-
-                for label, doc_title in zip(labels, doc_titles):
-                    title, doc = collection[doc_title]
-                    _doc = strip_html_xml_tags(doc)
-                    clean_doc = clean_text(_doc)
-                    clean_title = clean_text(title)
-                    if sentence_level:
-                        d= nlp(clean_doc)
-                        for i, sentence in enumerate(d.sents):
-                            passage = sentence.string.strip()
-                            doc_id = f'{doc_title}_{i}'
-                            sent_writer.write("\t".join((query_id, doc_id, clean_query, title, passage, str(label), str(len_gt_query))) + "\n")
-                    
-                    doc_writer.write("\t".join((query_id, doc_title, clean_query, title, clean_doc, str(label), str(len_gt_query))) + "\n")
-
-                if idx % 10 == 0:
-                    print('wrote {} of {} queries'.format(idx, len(data)))
-                    time_passed = time.time() - start_time
-                    est_hours = (len(data) - idx) * time_passed / (max(1.0, idx) * 3600)
-                    print('estimated total hours to save: {}'.format(est_hours))
-    if sentence_level:
-        sent_writer.close()
-
-
-def _load_qrels(path, set_name):
-    """Loads qrels into a dict of key: query_id, value: list of relevant doc ids."""
-    qrels = collections.defaultdict(set)
-
-    relevance_threshold = 1
-
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, _, doc_id, relevance = line.rstrip().split()
-                if int(relevance) >= relevance_threshold:
-                    qrels[query_id].add(doc_id)
-                if i % 1000 == 0:
-                    print('Loading qrels {}'.format(i))
-    return qrels
-
-
-def _load_queries(path):
-    """Loads queries into a dict of key: query_id, value: query text."""
-    queries = {}
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, query = line.rstrip().split('\t')
-                queries[query_id] = query
-                if i % 10 == 0:
-                    print('Loading queries {}'.format(i))
-    return queries
-
-
-def _load_run(path):
-    """Loads run into a dict of key: query_id, value: list of candidate doc ids."""
-    # We want to preserve the order of runs so we can pair the run file with the
-    # TFRecord file.
-    run = collections.OrderedDict()
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, doc_title, rank,_ = line.split('\t')
-                if query_id not in run:
-                    run[query_id] = []
-                run[query_id].append((doc_title, int(rank)))
-                if i % 1000 == 0:
-                    print('Loading run {}'.format(i))
-    # Sort candidate docs by rank.
-    sorted_run = collections.OrderedDict()
-    for query_id, doc_titles_ranks in run.items():
-            sorted(doc_titles_ranks, key=lambda x: x[1])
-            doc_titles = [doc_titles for doc_titles, _ in doc_titles_ranks]
-            sorted_run[query_id] = doc_titles
-
-    return sorted_run
-
 
 def _merge(qrels, run, queries):
     """Merge qrels and runs into a single dict of key: query, 
@@ -160,18 +71,6 @@ def _merge(qrels, run, queries):
     return data
 
 
-def _load_collection(path):
-    """Loads tsv collection into a dict of key: doc id, value: doc text."""
-    collection = {}
-    with open(path) as f:
-        for i, line in enumerate(f):
-                doc_id, url, doc_title, doc_text = line.rstrip().split('\t')
-                collection[doc_id] = (doc_title, doc_text.replace('\n', ' '))
-                if i % 10000 == 0:
-                    print('Loading collection, doc {}'.format(i))
-    return collection
-
-
 class MsMarcoDocumentProcessor(DataProcessor):
 
     def __init__(self, 
@@ -182,43 +81,64 @@ class MsMarcoDocumentProcessor(DataProcessor):
         self.handle = document_handle
         self.marker = marker
     
-    def get_eval_dataset (self, data_path, batch_size, num_skip=0):
-        return self.handle.get_eval_dataset(data_path, batch_size, num_skip)
+    def get_eval_dataset (self, data_path, batch_size, num_skip=0, vectorized=False):
+        return self.handle.get_eval_dataset(data_path, batch_size, num_skip, vectorized)
+
+    def _iter_docs(self, data_path):
+        """ (did, (title, doc)) of the pairs file, for the analysis store """
+        for line in iter_lines_with_progress(data_path, 'Read docs to analyze', log_every=100000):
+            fields = line.rstrip().split('\t')
+            yield fields[1], (fields[3], fields[4])
 
     def prepare_inference_dataset( self,
                              data_path, 
                              output_dir,
                              set_name,
+                             analysis_store=None,
+                             batch_size=1000,
+                             n_process=1,
+                             shard_size=None,
+                             shard_bytes=None,
+                             compression=None,
                               ):
-        tf_writer = tf.io.TFRecordWriter(f"{output_dir}/dataset_{set_name}.tf")
+        """ analysis_store: directory of the analysis of the documents (built from data_path if missing or stale),
+            the marker then only matches the stored stem ids of each document.
+            the pairs are marked by batches of the whole candidates of queries (at least batch_size lines),
+            on n_process processes. The candidates of a query must be consecutive lines.
+            shard_size, shard_bytes, compression: the tfrecords are written in shards of shard_size examples
+            or shard_bytes bytes, compressed with 'GZIP' or 'ZLIB', listed in a manifest (tfrecord_utils) """
+        if analysis_store:
+            self.marker.set_store(open_analysis_store(analysis_store, self._iter_docs(data_path), ('title', 'doc'), source_path=data_path))
+        tf_writer = open_tfrecord_writer(f"{output_dir}/dataset_{set_name}.tf", shard_size, shard_bytes, compression)
         tsv_writer = open(f"{output_dir}/pairs_{set_name}.tsv", 'w')
         ids_writer = open(f"{output_dir}/query_pass_ids_{set_name}.tsv", 'w')
         i_ids = 0
 
-        start_time = time.time()
-
-        print('Counting number of examples...')
-        num_lines = sum(1 for line in open(data_path, 'r'))
-        print('{} examples found.'.format(num_lines))
-        
-        with open(data_path, 'r') as f:
-            for i, line in enumerate(f):
-                if i % 1000 == 0:
-                    time_passed = int(time.time() - start_time)
-                    print('Processed training set, line {} of {} in {} sec'.format(
-                        i, num_lines, time_passed))
-                    hours_remaining = (num_lines - i) * time_passed / (max(1.0, i) * 3600)
-                    print('Estimated hours remaining to write the training set: {}'.format(
-                        hours_remaining))
-                              
-                qid, did, query, title ,doc, label, len_gt_query = line.rstrip().split('\t')
-
-                m_query, m_title, m_doc = self.marker.mark(query, title, doc)
-
-                # write tfrecord
-                i_ids = self.handle.write_eval_example(tf_writer, ids_writer, i_ids, m_query, [(m_title,m_doc)], [int(label)], qid, [did], int(len_gt_query)) ## stride pass_len
-                tsv_writer.write(f"{qid}\t{m_query}\t{did}\t{m_title}\t{m_doc}\t{label}\t{len_gt_query}\n")
+        lines = iter_lines_with_progress(data_path, f'Processed {set_name} set')
+        rows = (line.rstrip().split('\t') for line in lines)
+        pending = collections.deque()
+        def marking():
+            for groups in iter_group_batches(rows, lambda row: row[0], batch_size):
+                pending.append(groups)
+                batch = [row for group in groups for row in group]
+                yield [(row[2], row[3], row[4]) for row in batch], [row[1] for row in batch]
+        for marked in imap_mark_batches(self.marker, marking(), n_process):
+            groups = pending.popleft()
+            marked = iter(marked)
+            examples = []
+            for group in groups:
+                qid, len_gt_query = group[0][0], int(group[0][6])
+                m_queries, m_titles, m_docs = zip(*[next(marked) for _ in group])
+                examples += query_examples(qid, len_gt_query, m_queries, list(zip(m_titles, m_docs)),
+                                           [int(row[5]) for row in group], [row[1] for row in group])
+                for (_, did, _, _, _, label, _), m_query, m_title, m_doc in zip(group, m_queries, m_titles, m_docs):
+                    tsv_writer.write(f"{qid}\t{m_query}\t{did}\t{m_title}\t{m_doc}\t{label}\t{len_gt_query}\n")
+            # write tfrecord
+            i_ids = self.handle.write_eval_examples(tf_writer, ids_writer, i_ids, examples) ## stride pass_len
         tf_writer.close()
         tsv_writer.close()
         ids_writer.close()
+        print(self.handle.encoder)
+        if self.handle.encoder.mark_costs:
+            print(f'compact markers, {set_name}: {self.handle.stats}')
 
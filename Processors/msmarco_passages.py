@@ -1,13 +1,23 @@
 import logging
 import collections
-import tensorflow as tf
 import os, time
 
-from .processor_utils import DataProcessor, strip_html_xml_tags, clean_text
+from .processor_utils import DataProcessor, CleanDocCache, imap_queries, imap_mark_batches, query_examples, strip_html_xml_tags, clean_text
+from .collection_utils import CollectionIndex, get_run_doc_ids
+from .run_utils import Run
+from .reader_utils import TsvSchema, load_qrels, load_queries, load_collection, iter_lines_with_progress, iter_batches, iter_group_batches
 from .marker_utils import get_marker
+from .analysis_utils import open_analysis_store
+from .tfrecord_utils import open_tfrecord_writer
 
 logger = logging.getLogger(__name__)
 
+# column layouts of the msmarco passage files
+QRELS_SCHEMA = TsvSchema(('query_id', 'iteration', 'doc_id', 'relevance'))
+QUERIES_SCHEMA = TsvSchema(('query_id', 'query'))
+RUN_SCHEMA = TsvSchema(('query_id', 'doc_id', 'rank'))
+COLLECTION_SCHEMA = TsvSchema(('doc_id', 'text'), value_columns=('text',))
+
 
 # util functions for msmarco passage dataset
 def convert_eval_dataset(output_folder, 
@@ -16,115 +26,96 @@ def convert_eval_dataset(output_folder,
                         run_path, 
                         collection_path, 
                         set_name,
-                        num_eval_docs):
+                        num_eval_docs,
+                        index_collection=False,
+                        run_docs_only=False,
+                        clean_cache_size=10000,
+                        num_workers=1):
     
     if not os.path.exists(output_folder):
             os.mkdir(output_folder)
 
-    qrels = _load_qrels(qrels_path, set_name)
+    qrels = load_qrels(qrels_path, QRELS_SCHEMA, relevance_threshold=2 if set_name=='test' else 1)
 
-    queries = _load_queries(path=queries_path)
-    run = _load_run(path=run_path)
+    queries = load_queries(queries_path, QUERIES_SCHEMA)
+    run = Run.from_file(run_path, RUN_SCHEMA, max_depth=num_eval_docs)
     data = _merge(qrels=qrels, run=run, queries=queries)
 
     print('Loading Collection...')
-    collection = _load_collection(collection_path)
+    if index_collection:
+        collection = CollectionIndex(collection_path, COLLECTION_SCHEMA.parse_document)
+    elif run_docs_only:
+        collection = load_collection(collection_path, COLLECTION_SCHEMA, get_run_doc_ids(data, num_eval_docs), num_workers)
+    else:
+        collection = load_collection(collection_path, COLLECTION_SCHEMA, num_workers=num_workers)
 
     print('Converting to TFRecord...')
-    _convert_dataset(data,collection, set_name, num_eval_docs, output_folder)
+    _convert_dataset(data,collection, set_name, num_eval_docs, output_folder, clean_cache_size=clean_cache_size, num_workers=num_workers)
 
     print('Done!')
 
-def _convert_dataset(data, 
-                        collection, 
-                        set_name, 
-                        num_eval_docs, 
-                        output_folder):
+_worker = {}
 
-    output_path = output_folder + f'/run_{set_name}_full.tsv'
-    start_time = time.time()
-    random_title = list(collection.keys())[0]
+def _init_worker(collection, num_eval_docs, random_title, clean_cache_size):
+    """ sets the state shared by the queries converted in this process """
+    _worker['collection'] = collection
+    _worker['num_eval_docs'] = num_eval_docs
+    _worker['random_title'] = random_title
+    _worker['clean_cache'] = CleanDocCache(clean_cache_size)
 
-    with open(output_path, 'w') as writer:
-        for i, query_id in enumerate(data):
-                query, qrels, doc_titles = data[query_id]
+def _convert_query(item):
+    """ converts the candidates of one query, returns the lines of the output tsv """
+    query_id, query, qrels, doc_titles = item
+    collection = _worker['collection']
+    clean_cache = _worker['clean_cache']
+    num_eval_docs = _worker['num_eval_docs']
 
-                clean_query = clean_text(query)
+    clean_query = clean_text(query)
 
-                doc_titles = doc_titles[:num_eval_docs]
+    doc_titles = doc_titles[:num_eval_docs]
 
-                # Add fake docs so we always have max_docs per query.
-                doc_titles += max(0, num_eval_docs - len(doc_titles)) * [random_title]
+    # Add fake docs so we always have max_docs per query.
+    doc_titles += max(0, num_eval_docs - len(doc_titles)) * [_worker['random_title']]
 
-                labels = [
-                    1 if doc_title in qrels else 0 
-                    for doc_title in doc_titles
-                ]
+    labels = [
+        1 if doc_title in qrels else 0 
+        for doc_title in doc_titles
+    ]
 
-                len_gt_query = len(qrels)
+    len_gt_query = len(qrels)
 
-                for label, doc_title in zip(labels, doc_titles):
-                    _doc = strip_html_xml_tags(collection[doc_title])
-                    clean_doc = clean_text(_doc)
+    lines = []
+    for label, doc_title in zip(labels, doc_titles):
+        clean_doc = clean_cache.get(doc_title, collection[doc_title])
 
-                    writer.write("\t".join((query_id, doc_title, clean_query, clean_doc, str(label), str(len_gt_query))) + "\n")
+        lines.append("\t".join((query_id, doc_title, clean_query, clean_doc, str(label), str(len_gt_query))) + "\n")
+    return ''.join(lines)
+
+def _convert_dataset(data, 
+                        collection, 
+                        set_name, 
+                        num_eval_docs, 
+                        output_folder,
+                        clean_cache_size=10000,
+                        num_workers=1):
+
+    output_path = output_folder + f'/run_{set_name}_full.tsv'
+    start_time = time.time()
+    random_title = next(iter(collection))
+
+    items = ((query_id,) + tuple(data[query_id]) for query_id in data)
+    init_args = (collection, num_eval_docs, random_title, clean_cache_size)
+    with open(output_path, 'w') as writer:
+        for i, lines in enumerate(imap_queries(_convert_query, items, num_workers, _init_worker, init_args)):
+                writer.write(lines)
 
                 if i % 1000 == 0:
                     print('wrote {} of {} queries'.format(i, len(data)))
                     time_passed = time.time() - start_time
                     est_hours = (len(data) - i) * time_passed / (max(1.0, i) * 3600)
                     print('estimated total hours to save: {}'.format(est_hours))
-
-
-def _load_qrels(path, set_name):
-    """Loads qrels into a dict of key: query_id, value: list of relevant doc ids."""
-    qrels = collections.defaultdict(set)
-
-    relevance_threshold = 2 if set_name=='test' else 1
-
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, _, doc_id, relevance = line.rstrip().split('\t')
-                if int(relevance) >= relevance_threshold:
-                    qrels[query_id].add(doc_id)
-                if i % 1000 == 0:
-                    print('Loading qrels {}'.format(i))
-    return qrels
-
-
-def _load_queries(path):
-    """Loads queries into a dict of key: query_id, value: query text."""
-    queries = {}
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, query = line.rstrip().split('\t')
-                queries[query_id] = query
-                if i % 1000 == 0:
-                    print('Loading queries {}'.format(i))
-    return queries
-
-
-def _load_run(path):
-    """Loads run into a dict of key: query_id, value: list of candidate doc ids."""
-    # We want to preserve the order of runs so we can pair the run file with the
-    # TFRecord file.
-    run = collections.OrderedDict()
-    with open(path) as f:
-        for i, line in enumerate(f):
-                query_id, doc_title, rank = line.split('\t')
-                if query_id not in run:
-                    run[query_id] = []
-                run[query_id].append((doc_title, int(rank)))
-                if i % 1000000 == 0:
-                    print('Loading run {}'.format(i))
-    # Sort candidate docs by rank.
-    sorted_run = collections.OrderedDict()
-    for query_id, doc_titles_ranks in run.items():
-            sorted(doc_titles_ranks, key=lambda x: x[1])
-            doc_titles = [doc_titles for doc_titles, _ in doc_titles_ranks]
-            sorted_run[query_id] = doc_titles
-
-    return sorted_run
+    if num_workers <= 1:
+        print(_worker['clean_cache'])
 
 
 def _merge(qrels, run, queries):
@@ -140,18 +131,6 @@ def _merge(qrels, run, queries):
     return data
 
 
-def _load_collection(path):
-    """Loads tsv collection into a dict of key: doc id, value: doc text."""
-    collection = {}
-    with open(path) as f:
-        for i, line in enumerate(f):
-                doc_id, doc_text = line.rstrip().split('\t')
-                collection[doc_id] = doc_text.replace('\n', ' ')
-                if i % 1000000 == 0:
-                    print('Loading collection, doc {}'.format(i))
-    return collection
-
-
 def convert_train_dataset(train_dataset_path,
                         output_folder,
                         tokenizer,
@@ -159,36 +138,24 @@ def convert_train_dataset(train_dataset_path,
 
     print('Converting to Train to pairs tsv...')
 
-    start_time = time.time()
-
-    print('Counting number of examples...')
-    num_lines = sum(1 for line in open(train_dataset_path, 'r'))
-    print('{} examples found.'.format(num_lines))
-    
+    num_lines = 0
     with open(f'{output_folder}/train_pairs.tsv', 'w') as writer:
-        with open(train_dataset_path, 'r') as f:
-            for i, line in enumerate(f):
-                if i % 1000 == 0:
-                    time_passed = int(time.time() - start_time)
-                    print('Processed training set, line {} of {} in {} sec'.format(
-                        i, num_lines, time_passed))
-                    hours_remaining = (num_lines - i) * time_passed / (max(1.0, i) * 3600)
-                    print('Estimated hours remaining to write the training set: {}'.format(
-                        hours_remaining))
+        for line in iter_lines_with_progress(train_dataset_path, 'Processed training set'):
 
-                query, positive_doc, negative_doc = line.rstrip().split('\t')
+            query, positive_doc, negative_doc = line.rstrip().split('\t')
 
-                clean_query = clean_text(query)
-                positive_doc = strip_html_xml_tags(positive_doc)
-                positive_doc = clean_text(positive_doc)
-                negative_doc = strip_html_xml_tags(negative_doc)
-                negative_doc = clean_text(negative_doc)
+            clean_query = clean_text(query)
+            positive_doc = strip_html_xml_tags(positive_doc)
+            positive_doc = clean_text(positive_doc)
+            negative_doc = strip_html_xml_tags(negative_doc)
+            negative_doc = clean_text(negative_doc)
 
-                out.write('\t'.join([clean_query, positive_doc, 1])+'\n')
-                out.write('\t'.join([clean_query, negative_doc, 0])+'\n')     
+            writer.write('\t'.join([clean_query, positive_doc, '1'])+'\n')
+            writer.write('\t'.join([clean_query, negative_doc, '0'])+'\n')
+            num_lines += 2
 
     print("writer closed, DONE !")
-    print(f'writer closed with {i*2} lines')
+    print(f'writer closed with {num_lines} lines')
 
 class MsMarcoPassageProcessor(DataProcessor):
 
@@ -200,74 +167,93 @@ class MsMarcoPassageProcessor(DataProcessor):
         self.passage_handle = passage_handle
         self.marker = marker
 
-    def get_train_dataset (self, data_path, batch_size):
-        return self.passage_handle.get_train_dataset(data_path, batch_size)
+    def get_train_dataset (self, data_path, batch_size, vectorized=False):
+        return self.passage_handle.get_train_dataset(data_path, batch_size, vectorized)
     
-    def get_eval_dataset (self, data_path, batch_size, num_skip=0):
-        return self.passage_handle.get_eval_dataset(data_path, batch_size, num_skip)
+    def get_eval_dataset (self, data_path, batch_size, num_skip=0, vectorized=False):
+        return self.passage_handle.get_eval_dataset(data_path, batch_size, num_skip, vectorized)
 
     def prepare_train_dataset( self,
                              data_path, 
                              output_dir,
+                             batch_size=1000,
+                             n_process=1,
+                             shard_size=None,
+                             shard_bytes=None,
+                             compression=None,
                              ):
-        tf_writer = tf.io.TFRecordWriter(f"{output_dir}/dataset_train.tf")
+        """ the pairs are marked by batches of batch_size lines on n_process processes.
+            shard_size, shard_bytes, compression: sharded / compressed tfrecords (tfrecord_utils) """
+        tf_writer = open_tfrecord_writer(f"{output_dir}/dataset_train.tf", shard_size, shard_bytes, compression)
         tsv_writer = open(f"{output_dir}/pairs_train.tsv", 'w')
 
-        start_time = time.time()
-
-        print('Counting number of examples...')
-        num_lines = sum(1 for line in open(data_path, 'r'))
-        print('{} examples found.'.format(num_lines))
-
-        with open(data_path, 'r') as f:
-            for i, line in enumerate(f):
-                if i % 1000 == 0:
-                    time_passed = int(time.time() - start_time)
-                    print('Processed training set, line {} of {} in {} sec'.format(
-                        i, num_lines, time_passed))
-                    hours_remaining = (num_lines - i) * time_passed / (max(1.0, i) * 3600)
-                    print('Estimated hours remaining to write the training set: {}'.format(
-                        hours_remaining))
-
-                query, doc, label = line.rstrip().split('\t')
-                q, p = self.marker.mark(query, doc)
+        lines = iter_lines_with_progress(data_path, 'Processed training set')
+        pending = collections.deque()
+        def marking():
+            for batch in iter_batches((line.rstrip().split('\t') for line in lines), batch_size):
+                pending.append(batch)
+                yield [(query, doc) for query, doc, _ in batch], None
+        for marked in imap_mark_batches(self.marker, marking(), n_process):
+            batch = pending.popleft()
+            for (query, doc, label), (q, p) in zip(batch, marked):
                 # write tfrecord
                 self.passage_handle.write_train_example(tf_writer, q, [p], [int(label)])
                 tsv_writer.write(f"{q}\t{p}\t{label}\n")
         tf_writer.close()
         tsv_writer.close()
 
+    def _iter_docs(self, data_path):
+        """ (pid, (passage,)) of the pairs file, for the analysis store """
+        for line in iter_lines_with_progress(data_path, 'Read docs to analyze', log_every=100000):
+            fields = line.rstrip().split('\t')
+            yield fields[1], (fields[3],)
+
     def prepare_inference_dataset( self,
                              data_path, 
                              output_dir,
-                             set_name, ):
-        tf_writer = tf.io.TFRecordWriter(f"{output_dir}/dataset_{set_name}.tf")
+                             set_name,
+                             analysis_store=None,
+                             batch_size=1000,
+                             n_process=1,
+                             shard_size=None,
+                             shard_bytes=None,
+                             compression=None):
+        """ analysis_store: directory of the analysis of the passages (built from data_path if missing or stale),
+            the marker then only matches the stored stem ids of each passage.
+            the pairs are marked by batches of the whole candidates of queries (at least batch_size lines),
+            on n_process processes. The candidates of a query must be consecutive lines.
+            shard_size, shard_bytes, compression: the tfrecords are written in shards of shard_size examples
+            or shard_bytes bytes, compressed with 'GZIP' or 'ZLIB', listed in a manifest (tfrecord_utils) """
+        if analysis_store:
+            self.marker.set_store(open_analysis_store(analysis_store, self._iter_docs(data_path), ('doc',), source_path=data_path))
+        tf_writer = open_tfrecord_writer(f"{output_dir}/dataset_{set_name}.tf", shard_size, shard_bytes, compression)
         tsv_writer = open(f"{output_dir}/pairs_{set_name}.tsv", 'w')
 
-        start_time = time.time()
-
-        print('Counting number of examples...')
-        num_lines = sum(1 for line in open(data_path, 'r'))
-        print('{} examples found.'.format(num_lines))
-
-        with open(data_path, 'r') as f:
-            for i, line in enumerate(f):
-                if i % 1000 == 0:
-                    time_passed = int(time.time() - start_time)
-                    print('Processed training set, line {} of {} in {} sec'.format(
-                        i, num_lines, time_passed))
-                    hours_remaining = (num_lines - i) * time_passed / (max(1.0, i) * 3600)
-                    print('Estimated hours remaining to write the training set: {}'.format(
-                        hours_remaining))
-                
-                qid, pid, query, doc, label, len_gt_query = line.rstrip().split('\t')
-                q, p = self.marker.mark(query, doc)
-
-                # write tfrecord
-                self.passage_handle.write_eval_example(tf_writer, q, [p], [int(label)], qid, [pid], int(len_gt_query))
-                tsv_writer.write(f"{qid}\t{q}\t{pid}\t{p}\t{label}\t{len_gt_query}\n")
+        lines = iter_lines_with_progress(data_path, f'Processed {set_name} set')
+        rows = (line.rstrip().split('\t') for line in lines)
+        pending = collections.deque()
+        def marking():
+            for groups in iter_group_batches(rows, lambda row: row[0], batch_size):
+                pending.append(groups)
+                batch = [row for group in groups for row in group]
+                yield [(row[2], row[3]) for row in batch], [row[1] for row in batch]
+        for marked in imap_mark_batches(self.marker, marking(), n_process):
+            groups = pending.popleft()
+            marked = iter(marked)
+            examples = []
+            for group in groups:
+                qid, len_gt_query = group[0][0], int(group[0][5])
+                queries, passages = zip(*[next(marked) for _ in group])
+                examples += query_examples(qid, len_gt_query, queries, passages, [int(row[4]) for row in group], [row[1] for row in group])
+                for (_, pid, _, _, label, _), q, p in zip(group, queries, passages):
+                    tsv_writer.write(f"{qid}\t{q}\t{pid}\t{p}\t{label}\t{len_gt_query}\n")
+            # write tfrecord
+            self.passage_handle.write_eval_examples(tf_writer, examples)
         tf_writer.close()
         tsv_writer.close()
+        print(self.passage_handle.encoder)
+        if self.passage_handle.encoder.mark_costs:
+            print(f'compact markers, {set_name}: {self.passage_handle.stats}')
 
 
 
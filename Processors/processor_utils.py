@@ -1,12 +1,24 @@
 
 import logging
-import tensorflow as tf
+import array
+import collections
+import multiprocessing
 import os
 import re 
-from bs4 import BeautifulSoup
+import time
+import html
+import json
+import sys
+
+from .import_utils import tf
+from .tfrecord_utils import tfrecord_dataset, write_record, serialize_example
 
 logger = logging.getLogger(__name__)
 
+# version of the compact records: uint16 token ids cut to the sequence budget, integer query / doc ids
+COMPACT_RECORD_VERSION = 1
+COMPACT_MAX_VOCAB = 65536
+
 def clean_text(text):
     #encoding
     try:
@@ -25,20 +37,452 @@ def clean_text(text):
 
     return text
 
+_COMMENT_RE = re.compile(r'<!--.*?(?:-->|\Z)', re.S)
+_RAW_TEXT_RE = re.compile(r'<(script|style)\b[^>]*>.*?(?:</\1\s*>|\Z)', re.S | re.I)
+_TAG_RE = re.compile(r'''<(?:[/!?]?[A-Za-z](?:[^>"']|"[^"]*"|'[^']*')*(?:>|\Z)|[/!?]?[A-Za-z][^>]*(?:>|\Z)|!\[CDATA\[.*?\]\]>|\?[^>]*(?:>|\Z))''', re.S)
+
 def strip_html_xml_tags(text):
+    """ Streaming tag stripper, drops tags, comments and <script>/<style> content and decodes
+        the entities. Text without '<' is never parsed. Matches the text of strip_html_xml_tags_bs4
+        up to whitespace, which clean_text normalizes anyway (tests/test_strip_html.py), except:
+        a CDATA section is dropped whole (lxml keeps what follows its first '>') and a trailing
+        '</' without a tag name is kept (lxml drops it)."""
+    if '<' in text:
+        text = _COMMENT_RE.sub('', text)
+        text = _RAW_TEXT_RE.sub('', text)
+        text = _TAG_RE.sub('', text)
+    if '&' in text:
+        text = html.unescape(text)
+    return text
+
+def strip_html_xml_tags_bs4(text):
+    """ reference BeautifulSoup implementation, ~5x slower on tagged documents """
+    from bs4 import BeautifulSoup
     return BeautifulSoup(text, "lxml").text
 
 
+class CleanDocCache(object):
+    """ Bounded LRU cache of the cleaned document text (strip_html_xml_tags + clean_text),
+        key: doc id. The same document is retrieved for many queries of a run. """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.docs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id, doc_text):
+        """ returns the cleaned doc_text, cleans it only if doc_id is not in the cache """
+        if doc_id in self.docs:
+            self.hits += 1
+            self.docs.move_to_end(doc_id)
+            return self.docs[doc_id]
+        self.misses += 1
+        clean_doc = clean_text(strip_html_xml_tags(doc_text))
+        if self.max_size > 0:
+            self.docs[doc_id] = clean_doc
+            if len(self.docs) > self.max_size:
+                self.docs.popitem(last=False)
+        return clean_doc
+
+    def __str__(self):
+        total = max(1, self.hits + self.misses)
+        return 'clean doc cache: {} hits, {} misses ({:.1f}% hit rate)'.format(
+            self.hits, self.misses, 100.0 * self.hits / total)
+
+
+class SentenceSegmenter(object):
+    """ Splits each document into sentences only once, with batched nlp.pipe calls on n_process
+        processes. Only the sentence boundaries (char offsets in the cleaned text) are kept. """
+
+    def __init__(self, batch_size=256, n_process=1):
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.bounds = {}
+
+    def _load_nlp(self):
+        import spacy as sp
+        nlp = sp.load("en_core_web_sm", disable=['parser', 'tagger', 'ner'])
+        nlp.max_length = 2100000
+        nlp.add_pipe(nlp.create_pipe('sentencizer'))
+        return nlp
+
+    def segment(self, docs):
+        """ docs: iterable of (doc id, clean doc text), already segmented doc ids are skipped """
+        nlp = self._load_nlp()
+        start_time = time.time()
+        texts = ((clean_doc, doc_id) for doc_id, clean_doc in docs if doc_id not in self.bounds)
+        for i, (d, doc_id) in enumerate(nlp.pipe(texts, as_tuples=True, batch_size=self.batch_size, n_process=self.n_process)):
+            offsets = array.array('I')
+            for sentence in d.sents:
+                offsets.append(sentence.start_char)
+                offsets.append(sentence.end_char)
+            self.bounds[doc_id] = offsets
+            if i % 10000 == 0:
+                print('Segmented {} documents in {} sec'.format(i, int(time.time() - start_time)))
+
+    def sentences(self, doc_id, clean_doc):
+        """ returns the sentences of a segmented document """
+        offsets = self.bounds[doc_id]
+        return [clean_doc[offsets[i]:offsets[i + 1]].strip() for i in range(0, len(offsets), 2)]
+
+
+def imap_queries(convert_fn, items, num_workers=1, initializer=None, initargs=(), max_pending=None):
+    """ Applies convert_fn to the items (one per query) on a pool of num_workers processes.
+        The results are yielded in the order of the items so the output follows the run order.
+        max_pending: items sent to the pool ahead of the results (else the items are all read ahead)."""
+    if num_workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield convert_fn(item)
+        return
+    with multiprocessing.Pool(num_workers, initializer, initargs) as pool:
+        if max_pending is None:
+            for result in pool.imap(convert_fn, items):
+                yield result
+            return
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(convert_fn, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+_mark_worker = {}
+
+def _init_mark_worker(marker):
+    _mark_worker['marker'] = marker
+
+def _mark_batch(batch):
+    items, doc_ids = batch
+    return _mark_worker['marker'].mark_batch(items, doc_ids=doc_ids, marked_text=True)
+
+def imap_mark_batches(marker, batches, n_process=1):
+    """ marker.mark_batch(items, doc_ids, marked_text=True) of each (items, doc_ids) batch, on one pool
+        of n_process processes kept for all the batches (nlp.pipe(n_process) would start a pool per
+        batch). The marked batches are yielded in order, at most 2 * n_process batches are pending."""
+    return imap_queries(_mark_batch, batches, n_process, _init_mark_worker, (marker,), max_pending=2 * n_process)
+
+
+_convert_worker = {}
+
+def _init_convert_worker(collection, num_eval_docs, random_title, clean_cache, segmenter):
+    """ sets the state shared by the queries converted in this process """
+    _convert_worker['collection'] = collection
+    _convert_worker['num_eval_docs'] = num_eval_docs
+    _convert_worker['random_title'] = random_title
+    _convert_worker['clean_cache'] = clean_cache
+    _convert_worker['segmenter'] = segmenter
+
+def _convert_document_query(item):
+    """ converts the candidates of one query, returns the doc and sentence lines """
+    query_id, query, qrels, doc_titles = item
+    collection = _convert_worker['collection']
+    clean_cache = _convert_worker['clean_cache']
+    segmenter = _convert_worker['segmenter']
+    num_eval_docs = _convert_worker['num_eval_docs']
+
+    clean_query = clean_text(query)
+
+    doc_titles = doc_titles[:num_eval_docs]
+
+    # Add fake docs so we always have max_docs per query.
+    # (not with a score cut, the removed candidates must not be sent to BERT)
+    if _convert_worker['random_title'] is not None:
+        doc_titles += max(0, num_eval_docs - len(doc_titles)) * [_convert_worker['random_title']]
+
+    labels = [
+        1 if doc_title in qrels else 0
+        for doc_title in doc_titles
+    ]
+
+    len_gt_query = len(qrels)
+
+    doc_lines = []
+    sent_lines = []
+    for label, doc_title in zip(labels, doc_titles):
+        title, doc = collection[doc_title]
+        clean_doc = clean_cache.get(doc_title, doc)
+        if segmenter is not None:
+            for i, passage in enumerate(segmenter.sentences(doc_title, clean_doc)):
+                doc_id = f'{doc_title}_{i}'
+                sent_lines.append("\t".join((query_id, doc_id, clean_query, title, passage, str(label), str(len_gt_query))) + "\n")
+
+        doc_lines.append("\t".join((query_id, doc_title, clean_query, title, clean_doc, str(label), str(len_gt_query))) + "\n")
+    return ''.join(doc_lines), ''.join(sent_lines)
+
+def _iter_clean_docs(data, collection, num_eval_docs, random_title, clean_cache):
+    """ yields (doc id, clean doc text) of each candidate document once, cleaned through clean_cache
+        so that _convert_document_query reuses the text of the documents still in the cache """
+    seen = set()
+    for query_id in data:
+        _, _, doc_titles = data[query_id]
+        doc_titles = doc_titles[:num_eval_docs]
+        if random_title is not None and len(doc_titles) < num_eval_docs:
+            doc_titles = doc_titles + [random_title]
+        for doc_title in doc_titles:
+            if doc_title not in seen:
+                seen.add(doc_title)
+                yield doc_title, clean_cache.get(doc_title, collection[doc_title][1])
+
+def convert_document_dataset(data,
+                        collection,
+                        set_name,
+                        num_eval_docs,
+                        output_folder,
+                        sentence_level=True,
+                        clean_cache_size=10000,
+                        num_workers=1,
+                        sentence_batch_size=256,
+                        pad_docs=True):
+    """ writes the run_{set_name}_doc.tsv (and with sentence_level run_{set_name}_sentence.tsv) lines
+        of the candidates of the merged run data {query id: (query, qrels, doc ids)}, the collection
+        values being (title, text). With pad_docs, the queries with fewer than num_eval_docs
+        candidates are padded with the first document of the collection """
+    output_path = output_folder + f'/run_{set_name}_doc.tsv'
+    start_time = time.time()
+    random_title = next(iter(collection)) if pad_docs else None
+    segmenter = None
+    clean_cache = CleanDocCache(clean_cache_size)
+    if sentence_level:
+        sent_writer = open(output_folder + f'/run_{set_name}_sentence.tsv', 'w')
+        print('Splitting documents into sentences...')
+        segmenter = SentenceSegmenter(sentence_batch_size, num_workers)
+        segmenter.segment(_iter_clean_docs(data, collection, num_eval_docs, random_title, clean_cache))
+
+    items = ((query_id,) + tuple(data[query_id]) for query_id in data)
+    init_args = (collection, num_eval_docs, random_title, clean_cache, segmenter)
+    with open(output_path, 'w') as doc_writer:
+        for idx, (doc_lines, sent_lines) in enumerate(imap_queries(_convert_document_query, items, num_workers, _init_convert_worker, init_args)):
+                doc_writer.write(doc_lines)
+                if sentence_level:
+                    sent_writer.write(sent_lines)
+
+                if idx % 10 == 0:
+                    print('wrote {} of {} queries'.format(idx, len(data)))
+                    time_passed = time.time() - start_time
+                    est_hours = (len(data) - idx) * time_passed / (max(1.0, idx) * 3600)
+                    print('estimated total hours to save: {}'.format(est_hours))
+    if num_workers <= 1:
+        print(_convert_worker['clean_cache'])
+    if sentence_level:
+        sent_writer.close()
+
+
+def _has_bert_pre_tokenizer(tokenizer):
+    if not getattr(tokenizer, 'is_fast', False):
+        return False
+    return type(tokenizer.backend_tokenizer.pre_tokenizer).__name__ == 'BertPreTokenizer'
+
+
+class MarkEncoder(object):
+    """ Token ids (without special tokens) of the texts written by the handles.
+        A MarkedText (marker_utils) is not tokenized from its marked string: its clean text is
+        tokenized once (LRU cache of cache_size texts) by a fast wordpiece tokenizer with offsets,
+        and the ids of the marks are inserted before / after the tokens of their spans. The marks
+        start and end with punctuation that the bert pre-tokenizer always splits, so these are the
+        ids of the marked string as long as the spans start and end on word boundaries.
+        Other tokenizers, spans inside a word and plain str are tokenized from the string."""
+
+    def __init__(self, tokenizer, cache_size=10000):
+        self.tokenizer = tokenizer
+        self.fused = _has_bert_pre_tokenizer(tokenizer)
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._mark_ids = {}
+        # token count of the marks before they were added to the tokenizer (compact markers)
+        self.mark_costs = {}
+        self.num_fused = 0
+        self.num_fallback = 0
+
+    def reset(self):
+        """ drops the cached tokenizations, after tokens are added to the tokenizer """
+        self._cache.clear()
+        self._mark_ids = {}
+
+    def saved_tokens(self, text):
+        """ number of tokens the compact markers saved in the ids of a MarkedText """
+        if not self.mark_costs or not hasattr(text, 'marks'):
+            return 0
+        saved = 0
+        for _, _, prefix, suffix in text.marks:
+            for mark in (prefix, suffix):
+                if mark in self.mark_costs:
+                    saved += self.mark_costs[mark] - len(self._mark_token_ids(mark))
+        return saved
+
+    def _mark_token_ids(self, mark):
+        ids = self._mark_ids.get(mark)
+        if ids is None:
+            ids = self._mark_ids[mark] = self.tokenizer.encode(mark, add_special_tokens=False)
+        return ids
+
+    def _index_tokens(self, ids, offsets, words):
+        """ (ids, token index of the word starts by offset, token index of the word ends by offset) """
+        starts, ends = {}, {}
+        for k, (start, end) in enumerate(offsets):
+            if k == 0 or words[k - 1] != words[k]:
+                starts[start] = k
+            if k == len(ids) - 1 or words[k + 1] != words[k]:
+                ends[end] = k
+        return ids, starts, ends
+
+    def _add_to_cache(self, text, entry):
+        if self.cache_size > 0:
+            self._cache[text] = entry
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _clean_tokens(self, text):
+        entry = self._cache.get(text)
+        if entry is not None:
+            self._cache.move_to_end(text)
+            return entry
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        words = encoding.word_ids() if hasattr(encoding, 'word_ids') else encoding.words() # transformers 3
+        entry = self._index_tokens(encoding['input_ids'], encoding['offset_mapping'], words)
+        self._add_to_cache(text, entry)
+        return entry
+
+    def _clean_tokens_batch(self, texts):
+        """ tokenizes the clean texts that are not cached in one call of the fast tokenizer,
+            returns {text: entry} for all the texts """
+        entries = {}
+        missing = []
+        for text in texts:
+            if text in entries:
+                continue
+            entry = self._cache.get(text)
+            if entry is None:
+                entries[text] = None
+                missing.append(text)
+            else:
+                self._cache.move_to_end(text)
+                entries[text] = entry
+        if missing:
+            encodings = self.tokenizer(missing, add_special_tokens=False, return_offsets_mapping=True)
+            for i, text in enumerate(missing):
+                words = encodings.word_ids(i) if hasattr(encodings, 'word_ids') else encodings.words(i) # transformers 3
+                entries[text] = self._index_tokens(encodings['input_ids'][i], encodings['offset_mapping'][i], words)
+                self._add_to_cache(text, entries[text])
+        return entries
+
+    def _fuse(self, marked, entry=None):
+        ids, starts, ends = entry or self._clean_tokens(marked.text)
+        fused = []
+        last = 0
+        for start, end, prefix, suffix in marked.marks:
+            first, final = starts.get(start), ends.get(end)
+            if first is None or final is None or first < last or final < first:
+                return None
+            fused += ids[last:first]
+            fused += self._mark_token_ids(prefix)
+            fused += ids[first:final + 1]
+            fused += self._mark_token_ids(suffix)
+            last = final + 1
+        fused += ids[last:]
+        return fused
+
+    def encode(self, text):
+        if self.fused and hasattr(text, 'marks'):
+            ids = self._fuse(text)
+            if ids is not None:
+                self.num_fused += 1
+                return ids
+            self.num_fallback += 1
+        return self.tokenizer.encode(str(text), add_special_tokens=False)
+
+    def encode_batch(self, texts):
+        """ token ids of a list of (marked) texts, the same as encode. With a fast tokenizer the
+            clean texts and the strings to tokenize go through one batch call each."""
+        if not getattr(self.tokenizer, 'is_fast', False):
+            return [self.encode(text) for text in texts]
+        results = [None] * len(texts)
+        if self.fused:
+            entries = self._clean_tokens_batch([text.text for text in texts if hasattr(text, 'marks')])
+            for i, text in enumerate(texts):
+                if hasattr(text, 'marks'):
+                    results[i] = self._fuse(text, entries[text.text])
+                    if results[i] is None:
+                        self.num_fallback += 1
+                    else:
+                        self.num_fused += 1
+        pending = [i for i, ids in enumerate(results) if ids is None]
+        if pending:
+            encodings = self.tokenizer([str(texts[i]) for i in pending], add_special_tokens=False)
+            for i, ids in zip(pending, encodings['input_ids']):
+                results[i] = ids
+        return results
+
+    def __str__(self):
+        return 'MarkEncoder: {} fused, {} tokenized from the marked string'.format(self.num_fused, self.num_fallback)
+
+
+def text_key(text):
+    """ hashable identity of a str or MarkedText, equal keys have the same marked string """
+    if hasattr(text, 'marks'):
+        return text.text, tuple(text.marks)
+    return text
+
+
+def query_examples(query_id, len_gt, queries, docs, labels, doc_ids):
+    """ the (query, docs, labels, query_id, doc_ids, len_gt) examples of the handles for the
+        candidates of a query: one example per run of consecutive candidates with the same marked
+        query (all of them with the pass strategies, the pair strategies mark the query per doc) """
+    examples = []
+    last = None
+    for query, doc, label, doc_id in zip(queries, docs, labels, doc_ids):
+        key = text_key(query)
+        if key != last:
+            last = key
+            examples.append((query, [], [], query_id, [], len_gt))
+        examples[-1][1].append(doc)
+        examples[-1][2].append(label)
+        examples[-1][4].append(doc_id)
+    return examples
+
+
+class MarkerStats(object):
+    """ Sequence length and number of examples written per pair, and what they would be with the
+        marks tokenized as plain text (without the compact marker tokens) """
+
+    def __init__(self):
+        self.pairs = 0
+        self.tokens = 0
+        self.tokens_before = 0
+        self.examples = 0
+        self.examples_before = 0
+
+    def add(self, tokens, saved, examples=1, examples_before=1):
+        self.pairs += 1
+        self.tokens += tokens
+        self.tokens_before += tokens + saved
+        self.examples += examples
+        self.examples_before += examples_before
+
+    def __str__(self):
+        pairs = max(1, self.pairs)
+        return ('{} pairs, avg tokens per pair {:.1f} (plain text marks {:.1f}, -{:.1%}), '
+                'avg examples per pair {:.3f} (plain text marks {:.3f}, -{:.1%})').format(
+            self.pairs, self.tokens / pairs, self.tokens_before / pairs,
+            1 - self.tokens / max(1, self.tokens_before),
+            self.examples / pairs, self.examples_before / pairs,
+            1 - self.examples / max(1, self.examples_before))
+
+
 class DataProcessor(object):
     
     # def __init__(self):
         
     
-    def get_train_dataset (self, data_path, batch_size):
+    def get_train_dataset (self, data_path, batch_size, vectorized=False):
         """ Reads a TFRecord dataset """
         raise NotImplementedError()
 
-    def get_eval_dataset (self, data_path, batch_size, num_skip=0):
+    def get_eval_dataset (self, data_path, batch_size, num_skip=0, vectorized=False):
         """ Reads a TFRecord file containing eval examples and returns a TF dataset"""
         raise NotImplementedError ()
     
@@ -59,15 +503,159 @@ class DataProcessor(object):
 
 class TFRecordHandle(object):
 
-    def __init__(self, tokenizer, max_seq_length, max_query_length):
+    def __init__(self, tokenizer, max_seq_length, max_query_length, compact_records=False):
+        if compact_records and len(tokenizer) > COMPACT_MAX_VOCAB:
+            raise ValueError(f'compact records store the token ids as uint16, the vocabulary has {len(tokenizer)} tokens')
         self.tokenizer = tokenizer
+        self.compact_records = compact_records
+        self.record_version = COMPACT_RECORD_VERSION if compact_records else 0
         self.max_seq_length = max_seq_length
         self.max_query_length = max_query_length
+        self.encoder = MarkEncoder(tokenizer)
+        self.stats = MarkerStats()
+
+    def add_marker_tokens(self, strategy, output_dir=None):
+        """ Compact markers: registers the marks of the strategy (for queries of up to max_query_length
+            stems) that the tokenizer splits in several tokens as single added tokens.
+            Returns the marker vocabulary {mark: token id}, saved with the tokenizer in output_dir
+            (marker_vocab.json, tokenizer/): the model must resize its token embeddings to len(tokenizer)."""
+        from .marker_utils import get_marker_strings
+        base_size = len(self.tokenizer)
+        for mark in get_marker_strings(strategy, self.max_query_length):
+            self.encoder.mark_costs[mark] = len(self.tokenizer.encode(mark, add_special_tokens=False))
+        self.tokenizer.add_tokens([mark for mark, cost in self.encoder.mark_costs.items() if cost > 1])
+        self.encoder.reset()
+        tokens = {mark: self.tokenizer.convert_tokens_to_ids(mark) if cost > 1 else self.tokenizer.encode(mark, add_special_tokens=False)[0]
+                  for mark, cost in self.encoder.mark_costs.items()}
+        marker_vocab = {'strategy': strategy, 'base_vocab_size': base_size, 'vocab_size': len(self.tokenizer), 'tokens': tokens}
+        if output_dir is not None:
+            with open(f"{output_dir}/marker_vocab.json", 'w') as writer:
+                json.dump(marker_vocab, writer, indent=2)
+            self.tokenizer.save_pretrained(f"{output_dir}/tokenizer")
+        return marker_vocab
+
+    def _token_ids(self, text, add_special_tokens=True, max_length=None):
+        """ the input_ids of tokenizer.encode_plus(text, add_special_tokens, max_length),
+            the (marked) text is tokenized by the MarkEncoder """
+        return self._truncate(self.encoder.encode(text), add_special_tokens, max_length)
 
-    def get_train_dataset(self, data_path, batch_size):
+    def _encode_texts(self, texts):
+        """ encoder.encode_batch of the distinct texts, the query of the pairs of a same query is
+            tokenized once """
+        keys = [text_key(text) for text in texts]
+        index = {}
+        unique = []
+        for key, text in zip(keys, texts):
+            if key not in index:
+                index[key] = len(unique)
+                unique.append(text)
+        ids = self.encoder.encode_batch(unique)
+        return [ids[index[key]] for key in keys]
+
+    def _truncate(self, ids, add_special_tokens=True, max_length=None):
+        num_special = self.tokenizer.num_special_tokens_to_add() if add_special_tokens else 0
+        if max_length is not None and len(ids) + num_special > max_length:
+            ids = ids[:max(0, max_length - num_special)]
+        if add_special_tokens:
+            ids = self.tokenizer.build_inputs_with_special_tokens(ids)
+        return ids
+
+    def _token_feature(self, ids, max_length=None):
+        """ int64 list of the token ids, or with compact records their uint16 little endian bytes cut to max_length """
+        if not self.compact_records:
+            return ids
+        ids = array.array('H', ids[:max_length])
+        if sys.byteorder == 'big':
+            ids.byteswap()
+        return ids.tobytes()
+
+    def _id_feature(self, id_):
+        """ the query / doc id string, interned to its integer value with compact records """
+        if not self.compact_records:
+            return id_.encode()
+        return [int(id_)]
+
+    def _features(self, feature):
+        """ the features of an example, serialized by tfrecord_utils.serialize_example """
+        if self.compact_records:
+            feature['format_version'] = [COMPACT_RECORD_VERSION]
+        return feature
+
+    def _record_version(self, dataset):
+        """ the format_version of the first record of the dataset, 0 for the int64 records """
+        for record in dataset.take(1):
+            return int(tf.io.parse_single_example(record, {
+                'format_version': tf.io.FixedLenFeature([], tf.int64, default_value=0)})['format_version'])
+        return 0
+
+    def _token_spec(self, version):
+        if version >= COMPACT_RECORD_VERSION:
+            return tf.io.FixedLenFeature([], tf.string)
+        return tf.io.FixedLenSequenceFeature([], tf.int64, allow_missing=True)
+
+    def _decode_tokens(self, tokens, version):
+        if version >= COMPACT_RECORD_VERSION:
+            tokens = tf.io.decode_raw(tokens, tf.uint16)
+        return tf.cast(tokens, tf.int32)
+
+    def _count(self, dataset, num_examples, num_skip=0):
+        """ the number of examples of the manifest of a sharded dataset, else counted by reading the dataset """
+        if num_examples is not None:
+            return max(0, num_examples - num_skip)
+        return dataset.reduce(0, lambda x, _: x + 1).numpy()
+
+    def _batch_token_spec(self, version):
+        """ _token_spec for tf.io.parse_example, the int64 lists are kept with their lengths (sparse) """
+        if version >= COMPACT_RECORD_VERSION:
+            return tf.io.FixedLenFeature([], tf.string)
+        return tf.io.VarLenFeature(tf.int64)
+
+    def _batch_tokens(self, tokens, version):
+        """ the ragged [batch, (tokens)] int32 token ids of a feature parsed with _batch_token_spec """
+        if version >= COMPACT_RECORD_VERSION:
+            # decode_raw needs strings of equal length: zero pad them to the longest of the batch
+            lengths = tf.strings.length(tokens) // 2
+            fixed_length = tf.maximum(2 * tf.reduce_max(lengths), 2)
+            ids = tf.cast(tf.io.decode_raw(tokens, tf.uint16, fixed_length=fixed_length), tf.int32)
+            return tf.RaggedTensor.from_tensor(ids, lengths=lengths)
+        tokens = tf.RaggedTensor.from_sparse(tokens)
+        return tokens.with_values(tf.cast(tokens.values, tf.int32))
+
+    def _batch_rows(self, tokens, starts, lengths):
+        """ the ragged rows tokens[i, starts[i]:starts[i] + lengths[i]] """
+        positions = tf.ragged.range(starts, starts + lengths).values + tf.repeat(tokens.row_starts(), lengths)
+        return tf.RaggedTensor.from_row_lengths(tf.gather(tokens.values, positions), lengths)
+
+    def _batch_inputs(self, pieces, first_segment_lengths):
+        """ input_ids, attention_mask and token_type_ids [batch, max_seq_length] of the ragged pieces
+            concatenated, the token types are 1 after first_segment_lengths tokens """
+        input_ids = tf.concat(pieces, axis=1)
+        lengths = tf.expand_dims(input_ids.row_lengths(), 1)
+        input_ids = input_ids.to_tensor(0)
+        input_ids = tf.pad(input_ids, [[0, 0], [0, self.max_seq_length - tf.shape(input_ids)[1]]])
+        input_ids.set_shape([None, self.max_seq_length])
+        positions = tf.expand_dims(tf.range(self.max_seq_length, dtype=tf.int64), 0)
+        input_mask = tf.cast(positions < lengths, tf.int32)
+        segment_ids = tf.cast(positions >= tf.expand_dims(first_segment_lengths, 1), tf.int32) * input_mask
+        return input_ids, input_mask, segment_ids
+
+    def _vectorized_dataset(self, dataset, num_examples, batch_size, extract_fn, num_skip=0, is_training=False):
+        """ batches the serialized records first, extract_fn parses and encodes a whole batch
+            (tf.io.parse_example, ragged ops) in parallel, the batches are prefetched """
+        if num_skip > 0:
+            dataset = dataset.skip(num_skip)
+        count = self._count(dataset, num_examples, num_skip)
+        if is_training:
+            dataset = dataset.repeat()
+            dataset = dataset.shuffle(buffer_size=1000, seed=42)
+        dataset = dataset.batch(batch_size, drop_remainder=is_training)
+        dataset = dataset.map(extract_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE), count
+
+    def get_train_dataset(self, data_path, batch_size, vectorized=False):
         raise NotImplementedError()
-    
-    def get_eval_dataset(self, data_path, batch_size, num_skip=0):
+
+    def get_eval_dataset(self, data_path, batch_size, num_skip=0, vectorized=False):
         raise NotImplementedError()
     
     def write_train_example(self, tf_writer,
@@ -84,22 +672,37 @@ class TFRecordHandle(object):
                                             doc_ids,
                                             len_gt):
         raise NotImplementedError()
+
+    def write_eval_examples(self, tf_writer, examples):
+        """ writes a batch of (query, docs, labels, query_id, doc_ids, len_gt) examples,
+            the texts of the batch are tokenized together """
+        raise NotImplementedError()
     
-    def _extract_fn_train(self,data_record):
+    def _extract_fn_train(self,data_record, version=0):
         raise NotImplementedError()
     
-    def _extract_fn_eval(self,data_record):
+    def _extract_fn_eval(self,data_record, version=0):
+        raise NotImplementedError()
+
+    def _extract_batch_train(self, data_records, version=0):
+        raise NotImplementedError()
+
+    def _extract_batch_eval(self, data_records, version=0):
         raise NotImplementedError()
 
 
 class PassageHandle(TFRecordHandle):
-    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64):
-        super(PassageHandle,self).__init__(tokenizer, max_seq_length, max_query_length)
+    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64, compact_records=False):
+        super(PassageHandle,self).__init__(tokenizer, max_seq_length, max_query_length, compact_records)
         
-    def get_train_dataset (self, data_path, batch_size):
-        dataset = tf.data.TFRecordDataset([data_path])
-        dataset = dataset.map( lambda record : self._extract_fn_train(record)).prefetch(batch_size*1000)
-        count = dataset.reduce(0, lambda x, _: x + 1)
+    def get_train_dataset (self, data_path, batch_size, vectorized=False):
+        dataset, num_examples = tfrecord_dataset(data_path)
+        version = self._record_version(dataset)
+        if vectorized:
+            return self._vectorized_dataset(dataset, num_examples, batch_size,
+                                            lambda records : self._extract_batch_train(records, version), is_training=True)
+        dataset = dataset.map( lambda record : self._extract_fn_train(record, version), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        count = self._count(dataset, num_examples)
         dataset = dataset.repeat()
         dataset = dataset.shuffle(buffer_size=1000, seed=42)
         dataset = dataset.padded_batch(
@@ -117,14 +720,18 @@ class PassageHandle(TFRecordHandle):
                         0
                     ),
                     drop_remainder=True)
-        return dataset, count.numpy() #count
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE), count
     
-    def get_eval_dataset (self, data_path, batch_size, num_skip=0):
-        dataset = tf.data.TFRecordDataset([data_path])
-        dataset = dataset.map( lambda record : self._extract_fn_eval(record)).prefetch(batch_size*1000)
+    def get_eval_dataset (self, data_path, batch_size, num_skip=0, vectorized=False):
+        dataset, num_examples = tfrecord_dataset(data_path)
+        version = self._record_version(dataset)
+        if vectorized:
+            return self._vectorized_dataset(dataset, num_examples, batch_size,
+                                            lambda records : self._extract_batch_eval(records, version), num_skip)
+        dataset = dataset.map( lambda record : self._extract_fn_eval(record, version), num_parallel_calls=tf.data.experimental.AUTOTUNE)
         if num_skip > 0:
             dataset = dataset.skip(num_skip)
-        count = dataset.reduce(0, lambda x, _: x + 1)
+        count = self._count(dataset, num_examples, num_skip)
         dataset = dataset.padded_batch(
                     batch_size=batch_size,
                     padded_shapes=({
@@ -146,20 +753,18 @@ class PassageHandle(TFRecordHandle):
                         }, 0
                     ),
                     drop_remainder=False)
-        return dataset, count.numpy()
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE), count
 
-    def _extract_fn_train(self,data_record):
+    def _extract_fn_train(self,data_record, version=0):
         features = {
-          "query_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
-          "doc_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
+          "query_ids": self._token_spec(version),
+          "doc_ids": self._token_spec(version),
           "label": tf.io.FixedLenFeature([], tf.int64),
         }
         sample = tf.io.parse_single_example(data_record, features)
         
-        query_ids = tf.cast(sample["query_ids"], tf.int32) # max length with special tokens
-        doc_ids = tf.cast(sample["doc_ids"], tf.int32) #max length with special tokens
+        query_ids = self._decode_tokens(sample["query_ids"], version) # max length with special tokens
+        doc_ids = self._decode_tokens(sample["doc_ids"], version) #max length with special tokens
         label_ids = tf.cast(sample["label"], tf.int32)
         
         input_ids, input_mask, segment_ids = self._encode(query_ids, doc_ids)
@@ -173,28 +778,32 @@ class PassageHandle(TFRecordHandle):
         return (features, label_ids)
     
 
-    def _extract_fn_eval(self, data_record):
+    def _extract_fn_eval(self, data_record, version=0):
+        compact = version >= COMPACT_RECORD_VERSION
+        id_spec = tf.io.FixedLenFeature([], tf.int64 if compact else tf.string)
         features = {
-          "q_id" : tf.io.FixedLenFeature([], tf.string),
-          "d_id" : tf.io.FixedLenFeature([], tf.string),
-          "query_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
-          "doc_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
+          "q_id" : id_spec,
+          "d_id" : id_spec,
+          "query_ids": self._token_spec(version),
+          "doc_ids": self._token_spec(version),
           "label": tf.io.FixedLenFeature([], tf.int64),
           "len_gt_titles": tf.io.FixedLenFeature([], tf.int64),
         }
         sample = tf.io.parse_single_example(data_record, features)
         # create a function for this that is shared between eval and train
-        q_id = tf.strings.to_number(
-                sample['q_id'], out_type=tf.dtypes.int32
-        )
-        d_id = tf.strings.to_number(
-                sample['d_id'], out_type=tf.dtypes.int32
-        )
-
-        query_ids = tf.cast(sample["query_ids"], tf.int32) # max length with special tokens
-        doc_ids = tf.cast(sample["doc_ids"], tf.int32) #max length with special tokens
+        if compact:
+            q_id = tf.cast(sample['q_id'], tf.int32)
+            d_id = tf.cast(sample['d_id'], tf.int32)
+        else:
+            q_id = tf.strings.to_number(
+                    sample['q_id'], out_type=tf.dtypes.int32
+            )
+            d_id = tf.strings.to_number(
+                    sample['d_id'], out_type=tf.dtypes.int32
+            )
+
+        query_ids = self._decode_tokens(sample["query_ids"], version) # max length with special tokens
+        doc_ids = self._decode_tokens(sample["doc_ids"], version) #max length with special tokens
         label_ids = tf.cast(sample["label"], tf.int32)
         len_gt_titles = tf.cast(sample["len_gt_titles"], tf.int32)
         
@@ -210,7 +819,89 @@ class PassageHandle(TFRecordHandle):
         }
         
         return (features, label_ids)
-    
+
+    def _extract_batch_train(self, data_records, version=0):
+        features = {
+          "query_ids": self._batch_token_spec(version),
+          "doc_ids": self._batch_token_spec(version),
+          "label": tf.io.FixedLenFeature([], tf.int64),
+        }
+        sample = tf.io.parse_example(data_records, features)
+
+        query_ids = self._batch_tokens(sample["query_ids"], version)
+        doc_ids = self._batch_tokens(sample["doc_ids"], version)
+        label_ids = tf.cast(sample["label"], tf.int32)
+
+        input_ids, input_mask, segment_ids = self._encode_batch(query_ids, doc_ids)
+
+        features = {
+            "input_ids": input_ids,
+            "attention_mask": input_mask,
+            "token_type_ids": segment_ids,
+        }
+
+        return (features, label_ids)
+
+    def _extract_batch_eval(self, data_records, version=0):
+        compact = version >= COMPACT_RECORD_VERSION
+        id_spec = tf.io.FixedLenFeature([], tf.int64 if compact else tf.string)
+        features = {
+          "q_id" : id_spec,
+          "d_id" : id_spec,
+          "query_ids": self._batch_token_spec(version),
+          "doc_ids": self._batch_token_spec(version),
+          "label": tf.io.FixedLenFeature([], tf.int64),
+          "len_gt_titles": tf.io.FixedLenFeature([], tf.int64),
+        }
+        sample = tf.io.parse_example(data_records, features)
+        if compact:
+            q_id = tf.cast(sample['q_id'], tf.int32)
+            d_id = tf.cast(sample['d_id'], tf.int32)
+        else:
+            q_id = tf.strings.to_number(sample['q_id'], out_type=tf.dtypes.int32)
+            d_id = tf.strings.to_number(sample['d_id'], out_type=tf.dtypes.int32)
+
+        query_ids = self._batch_tokens(sample["query_ids"], version)
+        doc_ids = self._batch_tokens(sample["doc_ids"], version)
+        label_ids = tf.cast(sample["label"], tf.int32)
+        len_gt_titles = tf.cast(sample["len_gt_titles"], tf.int32)
+
+        input_ids, input_mask, segment_ids = self._encode_batch(query_ids, doc_ids)
+
+        features = {
+            "q_id" : q_id,
+            "d_id" : d_id,
+            "input_ids": input_ids,
+            "attention_mask": input_mask,
+            "token_type_ids": segment_ids,
+            "len_gt_titles": len_gt_titles,
+        }
+
+        return (features, label_ids)
+
+    def _encode_batch(self, query_ids, doc_ids):
+        """ _encode of a batch of ragged query and doc ids, padded to max_seq_length """
+        query_length = query_ids.row_lengths()
+        doc_length = doc_ids.row_lengths()
+        ones = tf.ones_like(query_length)
+        query_kept = tf.minimum(query_length - 1, self.max_query_length - 1) # without SEP
+        doc_kept = tf.maximum(tf.minimum(doc_length - 2, self.max_seq_length - 2 - query_kept), 0) # without CLS and SEP
+        pieces = [self._batch_rows(query_ids, tf.zeros_like(query_length), query_kept),
+                  self._batch_rows(query_ids, query_length - 1, ones), # SEP
+                  self._batch_rows(doc_ids, ones, doc_kept),
+                  self._batch_rows(doc_ids, doc_length - 1, ones)] # SEP
+        return self._batch_inputs(pieces, query_kept + 1)
+
+    def _input_length(self, query_ids, doc_ids):
+        """ the length of the input_ids _encode builds from the query and doc ids """
+        return min(min(len(query_ids) - 1, self.max_query_length - 1) + len(doc_ids), self.max_seq_length)
+
+    def _cut_pairs(self, query_ids, docs_ids):
+        """ the query and docs ids cut to what _encode keeps of them """
+        query_ids = query_ids[:-1][:self.max_query_length-1] + query_ids[-1:]
+        budget = self.max_seq_length - 1 - len(query_ids)
+        return query_ids, [doc_ids[:1] + doc_ids[1:-1][:budget] + doc_ids[-1:] for doc_ids in docs_ids]
+
     def _encode(self, query_ids, doc_ids):
         query_ids_without_sep = query_ids[:-1]
         query_ids_trunc = tf.concat((query_ids_without_sep[:self.max_query_length-1], query_ids[-1:]),0) # add SEP end
@@ -231,36 +922,26 @@ class PassageHandle(TFRecordHandle):
                                          query,
                                          docs,
                                          labels):
-        q_inputs = self.tokenizer.encode_plus(
-                query,
-                add_special_tokens = True,
-                max_length = self.max_seq_length,
-            )
-        query_ids = q_inputs["input_ids"] 
-        query_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=query_ids))
-                        
-        for i, (doc_text, label) in enumerate(zip(docs, labels)):
-            inputs = self.tokenizer.encode_plus(
-                    doc_text,
-                    add_special_tokens = True,
-                    max_length = self.max_seq_length,
-                )
-            doc_ids = inputs["input_ids"]  
+        query_ids, *docs_ids = [self._truncate(ids, max_length=self.max_seq_length) for ids in self._encode_texts([query] + list(docs))]
+        self._write_train_ids(tf_writer, query_ids, docs_ids, labels)
 
-            doc_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=doc_ids))
+    def _write_train_ids(self, tf_writer, query_ids, docs_ids, labels):
+        if self.compact_records:
+            query_ids, docs_ids = self._cut_pairs(query_ids, docs_ids)
+        query_ids_tf = self._token_feature(query_ids)
+                        
+        for i, (doc_ids, label) in enumerate(zip(docs_ids, labels)):
+            doc_ids_tf = self._token_feature(doc_ids)
 
-            labels_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=[label]))
+            labels_tf = [label]
 
-            features = tf.train.Features(feature={
+            features = self._features({
                 'query_ids': query_ids_tf,
                 'doc_ids': doc_ids_tf,
                 'label': labels_tf,
             })
-            example = tf.train.Example(features=features)
-            tf_writer.write(example.SerializeToString())
+            example = serialize_example(features)
+            write_record(tf_writer, example, None, self._input_length(query_ids, doc_ids), self.record_version)
     
     def write_eval_example(self, tf_writer,
                                             query,
@@ -269,40 +950,43 @@ class PassageHandle(TFRecordHandle):
                                             query_id, 
                                             doc_ids,
                                             len_gt):
-        q_id_tf = tf.train.Feature(
-                    bytes_list=tf.train.BytesList(value=[query_id.encode()]))
-
-        q_inputs = self.tokenizer.encode_plus(
-                    query,
-                    add_special_tokens=True,
-                    max_length= self.max_seq_length,
-                )
-        query_ids = q_inputs["input_ids"] 
-        query_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=query_ids))
+        self.write_eval_examples(tf_writer, [(query, docs, labels, query_id, doc_ids, len_gt)])
+
+    def write_eval_examples(self, tf_writer, examples):
+        texts = []
+        for query, docs, _, _, _, _ in examples:
+            texts.append(query)
+            texts += docs
+        tokens = iter(self._encode_texts(texts))
+        for query, docs, labels, query_id, doc_ids, len_gt in examples:
+            query_tokens = next(tokens)
+            query_saved = self.encoder.saved_tokens(query)
+            docs_ids = []
+            for doc_text in docs:
+                doc_tokens = next(tokens)
+                self.stats.add(len(query_tokens) + len(doc_tokens), query_saved + self.encoder.saved_tokens(doc_text))
+                docs_ids.append(self._truncate(doc_tokens, max_length=self.max_seq_length))
+            query_ids = self._truncate(query_tokens, max_length=self.max_seq_length)
+            self._write_eval_ids(tf_writer, query_ids, docs_ids, labels, query_id, doc_ids, len_gt)
+
+    def _write_eval_ids(self, tf_writer, query_ids, docs_ids, labels, query_id, doc_ids, len_gt):
+        if self.compact_records:
+            query_ids, docs_ids = self._cut_pairs(query_ids, docs_ids)
+        q_id_tf = self._id_feature(query_id)
+
+        query_ids_tf = self._token_feature(query_ids)
         
-        len_gt_titles_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[len_gt]))
+        len_gt_titles_tf = [len_gt]
                         
-        for i, (doc_title, doc_text, label) in enumerate(zip(doc_ids, docs, labels)):
+        for i, (doc_title, doc_token_ids, label) in enumerate(zip(doc_ids, docs_ids, labels)):
 
-            d_id_tf = tf.train.Feature(
-                        bytes_list=tf.train.BytesList(value=[doc_title.encode()]))
-            
-            inputs = self.tokenizer.encode_plus(
-                    doc_text,
-                    add_special_tokens=True,
-                    max_length=self.max_seq_length,
-                )
-            doc_ids = inputs["input_ids"]  
+            d_id_tf = self._id_feature(doc_title)
 
-            doc_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=doc_ids))
+            doc_ids_tf = self._token_feature(doc_token_ids)
 
-            labels_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=[label]))
+            labels_tf = [label]
 
-            features = tf.train.Features(feature={
+            features = self._features({
                 'q_id' : q_id_tf,
                 'd_id' : d_id_tf,
                 'query_ids' : query_ids_tf,
@@ -311,25 +995,29 @@ class PassageHandle(TFRecordHandle):
                 'len_gt_titles': len_gt_titles_tf,
             })
 
-            example = tf.train.Example(features=features)
-            tf_writer.write(example.SerializeToString())
+            example = serialize_example(features)
+            write_record(tf_writer, example, query_id, self._input_length(query_ids, doc_token_ids), self.record_version)
 
 
 class DocumentHandle(TFRecordHandle):
 
-    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64, max_title_length=64, chunk_size=384, stride=384):
-        super(DocumentHandle,self).__init__(tokenizer, max_seq_length, max_query_length)
+    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64, max_title_length=64, chunk_size=384, stride=384, compact_records=False):
+        super(DocumentHandle,self).__init__(tokenizer, max_seq_length, max_query_length, compact_records)
         self.max_title_length = max_title_length
         self.chunk_size = chunk_size
         self.stride = stride
 
     
-    def get_eval_dataset(self, data_path, batch_size, num_skip=0):
-        dataset = tf.data.TFRecordDataset([data_path])
-        dataset = dataset.map( lambda record : self._extract_fn_eval(record)).prefetch(batch_size*1000)
+    def get_eval_dataset(self, data_path, batch_size, num_skip=0, vectorized=False):
+        dataset, num_examples = tfrecord_dataset(data_path)
+        version = self._record_version(dataset)
+        if vectorized:
+            return self._vectorized_dataset(dataset, num_examples, batch_size,
+                                            lambda records : self._extract_batch_eval(records, version), num_skip)
+        dataset = dataset.map( lambda record : self._extract_fn_eval(record, version), num_parallel_calls=tf.data.experimental.AUTOTUNE)
         if num_skip > 0:
             dataset = dataset.skip(num_skip)
-        count = dataset.reduce(0, lambda x, _: x + 1)
+        count = self._count(dataset, num_examples, num_skip)
         dataset = dataset.padded_batch(
                     batch_size=batch_size,
                     padded_shapes=({
@@ -349,7 +1037,7 @@ class DocumentHandle(TFRecordHandle):
                         }, 0
                     ),
                     drop_remainder=False)
-        return dataset, count.numpy()
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE), count
     
     
     def write_eval_example(self, tf_writer, ids_writer, i_ids,
@@ -359,44 +1047,64 @@ class DocumentHandle(TFRecordHandle):
                                             query_id, 
                                             doc_ids,
                                             len_gt):
+        return self.write_eval_examples(tf_writer, ids_writer, i_ids, [(query, docs, labels, query_id, doc_ids, len_gt)])
+
+    def write_eval_examples(self, tf_writer, ids_writer, i_ids, examples):
+        """ writes a batch of (query, [(title, doc)], labels, query_id, doc_ids, len_gt) examples,
+            the texts of the batch are tokenized together. Returns the next i_ids """
+        texts = []
+        for query, docs, _, _, _, _ in examples:
+            texts.append(query)
+            for doc_title, doc_text in docs:
+                texts += (doc_title, doc_text)
+        tokens = iter(self._encode_texts(texts))
+        for query, docs, labels, query_id, doc_ids, len_gt in examples:
+            query_ids = self._truncate(next(tokens), max_length=self.max_query_length)
+            query_saved = self.encoder.saved_tokens(query)
+            titles_ids, docs_ids = [], []
+            for doc_title, doc_text in docs:
+                title_ids = self._truncate(next(tokens), False, self.max_title_length-1) # for the [SEP] token
+                doc_token_ids = next(tokens)
+                saved = self.encoder.saved_tokens(doc_text)
+                num_tokens = len(query_ids) + len(title_ids) + len(doc_token_ids) + 1
+                self.stats.add(num_tokens, query_saved + self.encoder.saved_tokens(doc_title) + saved,
+                               self._num_examples(num_tokens, len(doc_token_ids)),
+                               self._num_examples(num_tokens + saved, len(doc_token_ids) + saved))
+                titles_ids.append(title_ids)
+                docs_ids.append(doc_token_ids)
+            i_ids = self._write_eval_ids(tf_writer, ids_writer, i_ids, query_ids, titles_ids, docs_ids, labels, query_id, doc_ids, len_gt)
+        return i_ids
+
+    def _input_length(self, query_ids, title_ids, doc_ids):
+        """ the length of the input_ids _extract_fn_eval builds from the ids of an example """
+        return len(query_ids) + len(title_ids) + min(len(doc_ids), self._doc_length()) + 1
+
+    def _doc_length(self):
+        """ the number of doc ids _extract_fn_eval keeps in an example """
+        return self.max_seq_length - self.max_query_length - self.max_title_length
+
+    def _num_examples(self, num_tokens, doc_length):
+        """ number of examples _write_eval_ids writes for a document """
+        if num_tokens > self.max_seq_length:
+            return -(-doc_length // self.chunk_size)
+        return 1
+
+    def _write_eval_ids(self, tf_writer, ids_writer, i_ids, query_ids, titles_ids, docs_ids, labels, query_id, doc_ids, len_gt):
         # q_id_tf = tf.train.Feature(
         #             bytes_list=tf.train.BytesList(value=[query_id.encode()]))
 
-        q_inputs = self.tokenizer.encode_plus(
-                    query,
-                    add_special_tokens=True,
-                    max_length= self.max_query_length,
-                )
-        query_ids = q_inputs["input_ids"] 
-        query_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=query_ids))
+        query_ids_tf = self._token_feature(query_ids)
         
-        len_gt_titles_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[len_gt]))
+        len_gt_titles_tf = [len_gt]
                         
-        for i, (doc_id, doc_tuple, label) in enumerate(zip(doc_ids, docs, labels)):
-            doc_title, doc_text = doc_tuple
+        for i, (doc_id, title_ids, doc_ids, label) in enumerate(zip(doc_ids, titles_ids, docs_ids, labels)):
 
             # d_id_tf = tf.train.Feature(
             #             bytes_list=tf.train.BytesList(value=[doc_id.encode()]))
 
-            t_inputs = self.tokenizer.encode_plus(
-                    doc_title,
-                    add_special_tokens=False,
-                    max_length=self.max_title_length-1 , # for the [SEP] token
-                )
-            title_ids = t_inputs["input_ids"]  
-            title_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=title_ids))
+            title_ids_tf = self._token_feature(title_ids)
             
-            d_inputs = self.tokenizer.encode_plus(
-                    doc_text,
-                    add_special_tokens=False,
-                )
-            doc_ids = d_inputs["input_ids"]  
-            
-            labels_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=[label]))
+            labels_tf = [label]
             
             if len(doc_ids)+len(title_ids)+len(query_ids)+1 > self.max_seq_length:
                 i = 0
@@ -405,13 +1113,11 @@ class DocumentHandle(TFRecordHandle):
                     pass_id = f'{doc_id}_{i}'
                     i += 1
                     
-                    doc_ids_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=passage_ids))
+                    doc_ids_tf = self._token_feature(passage_ids, self._doc_length())
                     
-                    id_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[i_ids]))
+                    id_tf = [i_ids]
 
-                    features = tf.train.Features(feature={
+                    features = self._features({
                         'id' : id_tf,
                         'query_ids' : query_ids_tf,
                         'title_ids' : title_ids_tf,
@@ -420,18 +1126,16 @@ class DocumentHandle(TFRecordHandle):
                         'len_gt_titles': len_gt_titles_tf,
                     })
 
-                    example = tf.train.Example(features=features)
-                    tf_writer.write(example.SerializeToString())
+                    example = serialize_example(features)
+                    write_record(tf_writer, example, query_id, self._input_length(query_ids, title_ids, passage_ids), self.record_version)
                     ids_writer.write("\t".join([str(i_ids),query_id, pass_id])+"\n")
                     i_ids += 1
                     doc_ids = doc_ids[self.chunk_size:]
 
             else: 
-                doc_ids_tf = tf.train.Feature(
-                    int64_list=tf.train.Int64List(value=doc_ids))
-                id_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[i_ids]))
-                features = tf.train.Features(feature={
+                doc_ids_tf = self._token_feature(doc_ids, self._doc_length())
+                id_tf = [i_ids]
+                features = self._features({
                         'id' : id_tf,
                         'query_ids' : query_ids_tf,
                         'title_ids' : title_ids_tf,
@@ -439,35 +1143,32 @@ class DocumentHandle(TFRecordHandle):
                         'label': labels_tf,
                         'len_gt_titles': len_gt_titles_tf,
                     })
-                example = tf.train.Example(features=features)
-                tf_writer.write(example.SerializeToString())
+                example = serialize_example(features)
+                write_record(tf_writer, example, query_id, self._input_length(query_ids, title_ids, doc_ids), self.record_version)
                 ids_writer.write("\t".join([str(i_ids), query_id, doc_id])+"\n")
                 i_ids += 1
         return i_ids
 
     
-    def _extract_fn_eval(self, data_record):
+    def _extract_fn_eval(self, data_record, version=0):
         features = {
           "id" : tf.io.FixedLenFeature([], tf.int64),
-          "query_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
-          "title_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
-          "doc_ids": tf.io.FixedLenSequenceFeature(
-              [], tf.int64, allow_missing=True),
+          "query_ids": self._token_spec(version),
+          "title_ids": self._token_spec(version),
+          "doc_ids": self._token_spec(version),
           "label": tf.io.FixedLenFeature([], tf.int64),
           "len_gt_titles": tf.io.FixedLenFeature([], tf.int64),
         }
         sample = tf.io.parse_single_example(data_record, features)
 
         id_pair = tf.cast(sample["id"], tf.int32)
-        query_ids = tf.cast(sample["query_ids"], tf.int32) 
-        title_ids = tf.cast(sample["title_ids"], tf.int32) 
-        doc_ids = tf.cast(sample["doc_ids"], tf.int32) 
+        query_ids = self._decode_tokens(sample["query_ids"], version)
+        title_ids = self._decode_tokens(sample["title_ids"], version)
+        doc_ids = self._decode_tokens(sample["doc_ids"], version)
         label_ids = tf.cast(sample["label"], tf.int32)
         len_gt_titles = tf.cast(sample["len_gt_titles"], tf.int32)
         
-        d_len = self.max_seq_length - self.max_query_length - self.max_title_length
+        d_len = self._doc_length()
         document_ids = tf.concat(( title_ids, doc_ids[:d_len], query_ids[-1:]), axis= 0) # query_ids[-1:] == [SEP]
         input_ids = tf.concat((query_ids, document_ids), axis= 0)
 
@@ -486,64 +1187,78 @@ class DocumentHandle(TFRecordHandle):
         }
         
         return (features, label_ids)
-    
+
+    def _extract_batch_eval(self, data_records, version=0):
+        features = {
+          "id" : tf.io.FixedLenFeature([], tf.int64),
+          "query_ids": self._batch_token_spec(version),
+          "title_ids": self._batch_token_spec(version),
+          "doc_ids": self._batch_token_spec(version),
+          "label": tf.io.FixedLenFeature([], tf.int64),
+          "len_gt_titles": tf.io.FixedLenFeature([], tf.int64),
+        }
+        sample = tf.io.parse_example(data_records, features)
+
+        id_pair = tf.cast(sample["id"], tf.int32)
+        query_ids = self._batch_tokens(sample["query_ids"], version)
+        title_ids = self._batch_tokens(sample["title_ids"], version)
+        doc_ids = self._batch_tokens(sample["doc_ids"], version)
+        label_ids = tf.cast(sample["label"], tf.int32)
+        len_gt_titles = tf.cast(sample["len_gt_titles"], tf.int32)
+
+        query_length = query_ids.row_lengths()
+        doc_kept = tf.minimum(doc_ids.row_lengths(), self._doc_length())
+        pieces = [query_ids, title_ids,
+                  self._batch_rows(doc_ids, tf.zeros_like(doc_kept), doc_kept),
+                  self._batch_rows(query_ids, query_length - 1, tf.ones_like(query_length))] # query_ids[-1:] == [SEP]
+        input_ids, input_mask, segment_ids = self._batch_inputs(pieces, query_length)
+
+        features = {
+            "id" : id_pair,
+            "input_ids": input_ids,
+            "attention_mask": input_mask,
+            "token_type_ids": segment_ids,
+            "len_gt_titles": len_gt_titles,
+        }
+
+        return (features, label_ids)
+
 class DocumentSplitterHandle(DocumentHandle):
 
-    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64, max_title_length=64, chunk_size=384, stride=192):
-        super(DocumentSplitterHandle,self).__init__(tokenizer, max_seq_length, max_query_length, max_title_length, chunk_size, stride)
+    def __init__(self, tokenizer, max_seq_length=512, max_query_length=64, max_title_length=64, chunk_size=384, stride=192, compact_records=False):
+        super(DocumentSplitterHandle,self).__init__(tokenizer, max_seq_length, max_query_length, max_title_length, chunk_size, stride, compact_records)
 
-    def write_eval_example(self, tf_writer, ids_writer, i_ids,
-                                query,
-                                docs,
-                                labels,
-                                query_id, 
-                                doc_ids,
-                                len_gt):
-
-        q_inputs = self.tokenizer.encode_plus(
-                    query,
-                    add_special_tokens=True,
-                    max_length= self.max_query_length,
-                )
-        query_ids = q_inputs["input_ids"] 
-        query_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=query_ids))
+    def _num_examples(self, num_tokens, doc_length):
+        """ number of overlapping chunks _write_eval_ids writes for a document """
+        num_examples = 0
+        while doc_length > 0:
+            num_examples += 1
+            doc_length -= self.stride
+            if doc_length < self.stride:
+                break
+        return num_examples
+
+    def _write_eval_ids(self, tf_writer, ids_writer, i_ids, query_ids, titles_ids, docs_ids, labels, query_id, doc_ids, len_gt):
+
+        query_ids_tf = self._token_feature(query_ids)
         
-        len_gt_titles_tf = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[len_gt]))
+        len_gt_titles_tf = [len_gt]
                         
-        for i, (doc_id, doc_tuple, label) in enumerate(zip(doc_ids, docs, labels)):
-            doc_title, doc_text = doc_tuple
-
-            t_inputs = self.tokenizer.encode_plus(
-                    doc_title,
-                    add_special_tokens=False,
-                    max_length=self.max_title_length-1 , # for the [SEP] token
-                )
-            title_ids = t_inputs["input_ids"]  
-            title_ids_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=title_ids))
-
-            labels_tf = tf.train.Feature(
-                int64_list=tf.train.Int64List(value=[label]))
-            
-            d_inputs = self.tokenizer.encode_plus(
-                    doc_text,
-                    add_special_tokens=False,
-                )
-            doc_ids = d_inputs["input_ids"] 
+        for i, (doc_id, title_ids, doc_ids, label) in enumerate(zip(doc_ids, titles_ids, docs_ids, labels)):
+
+            title_ids_tf = self._token_feature(title_ids)
+
+            labels_tf = [label]
 
             i = 0
             while len(doc_ids)>0:
                 passage_ids = doc_ids[:self.chunk_size]
                 
-                doc_ids_tf = tf.train.Feature(
-                    int64_list=tf.train.Int64List(value=passage_ids))
+                doc_ids_tf = self._token_feature(passage_ids, self._doc_length())
                 
-                id_tf = tf.train.Feature(
-                    int64_list=tf.train.Int64List(value=[i_ids]))
+                id_tf = [i_ids]
                 
-                features = tf.train.Features(feature={
+                features = self._features({
                     'id' : id_tf,
                     'query_ids' : query_ids_tf,
                     'title_ids' : title_ids_tf,
@@ -552,8 +1267,8 @@ class DocumentSplitterHandle(DocumentHandle):
                     'len_gt_titles': len_gt_titles_tf,
                 })
 
-                example = tf.train.Example(features=features)
-                tf_writer.write(example.SerializeToString())
+                example = serialize_example(features)
+                write_record(tf_writer, example, query_id, self._input_length(query_ids, title_ids, passage_ids), self.record_version)
                 ids_writer.write("\t".join([str(i_ids),query_id, doc_id, str(i)])+"\n")
                 i_ids += 1
                 i += 1
@@ -0,0 +1,202 @@
+import logging
+import bz2
+import collections
+import gzip
+import itertools
+import lzma
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_SUFFIXES = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+CHUNK_SIZE = 1 << 24
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in COMPRESSED_SUFFIXES
+
+
+def open_input(path):
+    """ Opens a (gzip, bz2 or xz compressed) input file in binary mode """
+    open_fn = COMPRESSED_SUFFIXES.get(os.path.splitext(path)[1], open)
+    return open_fn(path, 'rb')
+
+
+def iter_lines(path, chunk_size=CHUNK_SIZE):
+    """ Streams the lines of a file (without the line break) as bytes, reading large chunks """
+    with open_input(path) as f:
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+
+class TsvSchema(object):
+    """ Column layout of a tsv file of a dataset.
+        columns: the names of the columns, the line must have exactly these columns.
+        value_columns: the columns of the value of a document (a single column or a tuple).
+        defaults: value of a column when it is empty.
+        sep: the column separator, None for any whitespace (trec qrels)."""
+
+    def __init__(self, columns, value_columns=(), defaults=None, sep='\t'):
+        self.columns = tuple(columns)
+        self.value_columns = tuple(value_columns)
+        self.defaults = defaults or {}
+        self.sep = sep
+        self._value_index = [self.columns.index(c) for c in self.value_columns]
+        self._default_index = [(self.columns.index(c), v) for c, v in self.defaults.items()]
+
+    def index(self, column):
+        return self.columns.index(column)
+
+    def split(self, line):
+        """ splits a (str) line into its columns """
+        fields = line.rstrip().split(self.sep)
+        if len(fields) != len(self.columns):
+            raise ValueError(f'expected the columns {self.columns}, got {len(fields)} fields in line: {line[:100]}')
+        for i, value in self._default_index:
+            if fields[i] == '':
+                fields[i] = value
+        return fields
+
+    def parse_document(self, line):
+        """ parses a collection line into a tuple (doc id, value) """
+        fields = self.split(line)
+        values = [fields[i].replace('\n', ' ') for i in self._value_index]
+        return fields[0], values[0] if len(values) == 1 else tuple(values)
+
+
+def iter_rows(path, schema, name='rows', log_every=1000000):
+    """ Streams the rows of a (compressed) tsv file as lists of str """
+    for i, line in enumerate(iter_lines(path)):
+        if i % log_every == 0:
+            print('Loading {} {}'.format(name, i))
+        yield schema.split(line.decode('utf-8'))
+
+
+def load_qrels(path, schema, relevance_threshold=1):
+    """Loads qrels into a dict of key: query_id, value: set of relevant doc ids."""
+    qrels = collections.defaultdict(set)
+    q, d, r = schema.index('query_id'), schema.index('doc_id'), schema.index('relevance')
+    for fields in iter_rows(path, schema, 'qrels'):
+        if int(fields[r]) >= relevance_threshold:
+            qrels[fields[q]].add(fields[d])
+    return qrels
+
+
+def load_queries(path, schema, text_column='query'):
+    """Loads queries into a dict of key: query_id, value: query text."""
+    q, t = schema.index('query_id'), schema.index(text_column)
+    return {fields[q]: fields[t] for fields in iter_rows(path, schema, 'queries')}
+
+
+_range_state = {}
+
+def _init_range_parser(doc_ids):
+    _range_state['doc_ids'] = doc_ids
+
+def _parse_range(args):
+    """ parses the collection lines starting in the byte range [start, end) """
+    path, schema, start, end = args
+    doc_ids = _range_state['doc_ids']
+    docs = []
+    with open(path, 'rb') as f:
+        if start > 0:
+            # skip the line started in the previous range
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            if doc_ids is None or pos == 0 or line[:line.find(b'\t')].decode('utf-8') in doc_ids:
+                docs.append(schema.parse_document(line.decode('utf-8')))
+            pos += len(line)
+    return docs
+
+
+def load_collection(path, schema, doc_ids=None, num_workers=1):
+    """Loads tsv collection into a dict of key: doc id, value: doc text (or tuple of the value columns).
+        If doc_ids is given only these documents (and the first one, used as padding) are kept.
+        Uncompressed collections are parsed in byte ranges on num_workers processes."""
+    start_time = time.time()
+    if num_workers <= 1 or is_compressed(path):
+        collection = {}
+        for i, line in enumerate(iter_lines(path)):
+            if i % 1000000 == 0:
+                print('Loading collection, doc {}'.format(i))
+            if doc_ids is not None and i > 0 and line[:line.find(b'\t')].decode('utf-8') not in doc_ids:
+                continue
+            doc_id, doc = schema.parse_document(line.decode('utf-8'))
+            collection[doc_id] = doc
+    else:
+        size = os.path.getsize(path)
+        num_ranges = num_workers * 4
+        bounds = [size * i // num_ranges for i in range(num_ranges + 1)]
+        ranges = [(path, schema, bounds[i], bounds[i + 1]) for i in range(num_ranges)]
+        collection = {}
+        with multiprocessing.Pool(num_workers, _init_range_parser, (doc_ids,)) as pool:
+            for i, docs in enumerate(pool.imap(_parse_range, ranges)):
+                collection.update(docs)
+                print('Loading collection, part {} of {}'.format(i + 1, num_ranges))
+    print('Loaded collection with {} docs in {} sec'.format(len(collection), int(time.time() - start_time)))
+    return collection
+
+
+def iter_lines_with_progress(path, name, log_every=1000):
+    """ Streams the (str) lines of a text file. The progress and the ETA are computed from the bytes
+        read against the file size, so the file is read only once. """
+    size = max(1, os.path.getsize(path))
+    start_time = time.time()
+    num_bytes = 0
+    with open(path, 'rb') as f:
+        for i, line in enumerate(f):
+            if i % log_every == 0:
+                time_passed = int(time.time() - start_time)
+                print('{}, line {} ({:.1f}% of the file) in {} sec'.format(
+                    name, i, 100.0 * num_bytes / size, time_passed))
+                hours_remaining = (size - num_bytes) * time_passed / (max(1, num_bytes) * 3600)
+                print('Estimated hours remaining: {}'.format(hours_remaining))
+            num_bytes += len(line)
+            yield line.decode('utf-8')
+
+
+def iter_batches(iterable, batch_size):
+    """ groups an iterable into lists of batch_size items (the last one can be shorter) """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_group_batches(iterable, key, batch_size):
+    """ groups the consecutive items of an iterable having the same key (the pairs of a query),
+        yields lists of whole groups of at least batch_size items (the last one can be shorter).
+        Only the current batch is in memory, a group larger than batch_size is a batch on its own """
+    batch, size = [], 0
+    for _, group in itertools.groupby(iterable, key):
+        group = list(group)
+        batch.append(group)
+        size += len(group)
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
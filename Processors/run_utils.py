@@ -0,0 +1,166 @@
+import logging
+import array
+import collections
+import heapq
+import time
+import numpy as np
+
+from .reader_utils import iter_lines
+
+logger = logging.getLogger(__name__)
+
+
+class RunSlice(object):
+    """ Candidate doc ids of one query, a view on the columns of a Run """
+
+    def __init__(self, run, start, end):
+        self.run = run
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        doc_ids = self.run.doc_ids
+        if isinstance(i, slice):
+            return [doc_ids[d] for d in self.run.didx[self.start:self.end][i].tolist()]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('run slice index out of range')
+        return doc_ids[int(self.run.didx[self.start + i])]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __reduce__(self):
+        # sent to the worker processes as a plain list, not with the whole run
+        return (list, (self[:],))
+
+
+class Run(object):
+    """ Columnar run: one row per (query, candidate) stored in numpy arrays
+        (query index, interned doc id, rank, score), sorted by query (in the order of the
+        run file) then by rank. """
+
+    def __init__(self, query_ids, doc_ids, qidx, didx, ranks, scores, qrels=None):
+        self.query_ids = query_ids
+        self.doc_ids = doc_ids
+        self._qrels = qrels or collections.defaultdict(set)
+        self._query_pos = {query_id: q for q, query_id in enumerate(query_ids)}
+        order = np.lexsort((ranks, qidx))
+        self._set_columns(qidx[order], didx[order], ranks[order], scores[order])
+
+    def _set_columns(self, qidx, didx, ranks, scores):
+        self.qidx = qidx
+        self.didx = didx
+        self.ranks = ranks
+        self.scores = scores
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(qidx, minlength=len(self.query_ids))))).tolist()
+
+    @classmethod
+    def from_file(cls, path, schema, relevance_threshold=1, max_depth=None, min_score_ratio=None):
+        """ Parses a (compressed) tsv run file with the columns query_id, doc_id, rank and optionally
+            score and relevance given by the schema, the query and doc ids are interned to integers.
+            max_depth: only the max_depth best ranked candidates of each query are kept, with a
+                bounded heap per query while the file is read.
+            min_score_ratio: drops the candidates with a score below min_score_ratio * the best
+                score of their query (for positive first stage scores such as BM25, the queries
+                with a best score <= 0 are kept whole).
+            relevance_col: the qrels are read from this column before any candidate is dropped."""
+        start_time = time.time()
+        qid_col, doc_col, rank_col = schema.index('query_id'), schema.index('doc_id'), schema.index('rank')
+        score_col = schema.index('score') if 'score' in schema.columns else None
+        relevance_col = schema.index('relevance') if 'relevance' in schema.columns else None
+        sep = schema.sep.encode('utf-8') if schema.sep else None
+        query_index, doc_index = {}, {}
+        qidx, didx, ranks = array.array('i'), array.array('i'), array.array('i')
+        scores = array.array('f')
+        heaps = collections.defaultdict(list)
+        relevant = collections.defaultdict(set)
+        for i, line in enumerate(iter_lines(path)):
+            fields = line.split(sep)
+            q = query_index.setdefault(fields[qid_col], len(query_index))
+            d = doc_index.setdefault(fields[doc_col], len(doc_index))
+            rank = int(fields[rank_col])
+            score = float(fields[score_col]) if score_col is not None else 0.0
+            if relevance_col is not None and int(fields[relevance_col]) >= relevance_threshold:
+                relevant[q].add(d)
+            if max_depth is None:
+                qidx.append(q)
+                didx.append(d)
+                ranks.append(rank)
+                scores.append(score)
+            else:
+                # keep the max_depth lowest (rank, line) of the query, heap[0] is the worst kept
+                heap = heaps[q]
+                entry = (-rank, -i, d, score)
+                if len(heap) < max_depth:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            if i % 1000000 == 0:
+                print('Loading run {}'.format(i))
+        num_lines = i + 1 if query_index else 0
+        for q in range(len(query_index)):
+            for neg_rank, _, d, score in sorted(heaps.pop(q, []), reverse=True):
+                qidx.append(q)
+                didx.append(d)
+                ranks.append(-neg_rank)
+                scores.append(score)
+        print('Loaded run with {} lines, {} queries in {} sec'.format(
+            num_lines, len(query_index), int(time.time() - start_time)))
+
+        query_ids = [q.decode('utf-8') for q in query_index]
+        doc_ids = [d.decode('utf-8') for d in doc_index]
+        qrels = collections.defaultdict(set)
+        for q, docs in relevant.items():
+            qrels[query_ids[q]] = set(doc_ids[d] for d in docs)
+        run = cls(query_ids, doc_ids,
+                  np.frombuffer(qidx, dtype=np.int32),
+                  np.frombuffer(didx, dtype=np.int32),
+                  np.frombuffer(ranks, dtype=np.int32),
+                  np.frombuffer(scores, dtype=np.float32),
+                  qrels)
+        if max_depth is not None:
+            print('max_depth {} kept {} of {} pairs ({} saved)'.format(
+                max_depth, run.num_pairs(), num_lines, num_lines - run.num_pairs()))
+        if min_score_ratio is not None:
+            num_pairs = run.num_pairs()
+            run.cut_scores(min_score_ratio)
+            print('min_score_ratio {} kept {} of {} pairs ({} saved)'.format(
+                min_score_ratio, run.num_pairs(), num_pairs, num_pairs - run.num_pairs()))
+        return run
+
+    def cut_scores(self, min_score_ratio):
+        """ drops the candidates with a score below min_score_ratio * the best score of their query.
+            The ratio only means something for positive scores: the queries whose best score is
+            <= 0 (log-probs, some BM25 variants) are not cut """
+        max_scores = np.full(len(self.query_ids), -np.inf, dtype=np.float32)
+        np.maximum.at(max_scores, self.qidx, self.scores)
+        best = max_scores[self.qidx]
+        keep = (best <= 0) | (self.scores >= min_score_ratio * best)
+        self._set_columns(self.qidx[keep], self.didx[keep], self.ranks[keep], self.scores[keep])
+
+    def num_pairs(self):
+        return len(self.qidx)
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __contains__(self, query_id):
+        return query_id in self._query_pos
+
+    def __getitem__(self, query_id):
+        q = self._query_pos[query_id]
+        return RunSlice(self, self.offsets[q], self.offsets[q + 1])
+
+    def items(self):
+        """ yields (query id, candidate doc ids sorted by rank) in the run order """
+        for q, query_id in enumerate(self.query_ids):
+            yield query_id, RunSlice(self, self.offsets[q], self.offsets[q + 1])
+
+    def qrels(self):
+        """ dict of key: query_id, value: set of relevant doc ids, read from the relevance column """
+        return self._qrels
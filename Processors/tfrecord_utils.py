@@ -0,0 +1,441 @@
+import logging
+import array
+import collections
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .import_utils import tf
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+META_SUFFIX = '.meta.json'
+META_VERSION = 1
+INDEX_SUFFIX = '.index.npz'
+COMPRESSIONS = (None, 'GZIP', 'ZLIB')
+# length (8 bytes) and the masked crc32 of the length and of the data (4 bytes each) of a record
+RECORD_OVERHEAD = 16
+
+
+# TFRecord framing, read without tensorflow to count and index the records of a dataset
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC32C_TABLE = None
+
+def _crc32c_python(data):
+    global _CRC32C_TABLE
+    if _CRC32C_TABLE is None:
+        logger.warning('google-crc32c is not installed, the TFRecord checksums are computed in pure python (slow)')
+        _CRC32C_TABLE = _crc32c_table()
+    table = _CRC32C_TABLE
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+try:
+    from google_crc32c import value as crc32c
+except ImportError:
+    try:
+        from crc32c import crc32c
+    except ImportError:
+        crc32c = _crc32c_python
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def frame_record(record):
+    """ the TFRecord framing of a record: length, masked crc of the length, data, masked crc of the data """
+    length = struct.pack('<Q', len(record))
+    return b''.join((length, struct.pack('<I', masked_crc32c(length)), record, struct.pack('<I', masked_crc32c(record))))
+
+
+def serialize_example(feature):
+    """ tf.train.Example(features=tf.train.Features(feature=...)).SerializeToString() of a dict {name: value},
+        the value being bytes, a list of bytes or int64 values (list, numpy array) """
+    features = {}
+    for name, value in feature.items():
+        if isinstance(value, bytes):
+            value = [value]
+        if isinstance(value, (list, tuple)) and value and isinstance(value[0], bytes):
+            features[name] = tf.train.Feature(bytes_list=tf.train.BytesList(value=value))
+        else:
+            features[name] = tf.train.Feature(int64_list=tf.train.Int64List(value=value.tolist() if isinstance(value, np.ndarray) else value))
+    return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
+
+
+class DatasetMeta(object):
+    """ Metadata of a written dataset, saved in the sidecar path.meta.json: the number of examples and
+        of queries, the stats of the input lengths (tokens) of the examples and the record schema version.
+        The readers take the number of examples from it instead of counting the records."""
+
+    def __init__(self):
+        self.num_examples = 0
+        self.query_ids = set()
+        self.lengths = collections.Counter()
+        self.schema_version = None
+
+    def add(self, query_id=None, num_tokens=None, version=0):
+        self.num_examples += 1
+        if query_id is not None:
+            self.query_ids.add(query_id)
+        if num_tokens is not None:
+            self.lengths[num_tokens] += 1
+        self.schema_version = version
+
+    def _length_stats(self):
+        count = sum(self.lengths.values())
+        if count == 0:
+            return None
+        stats = {'min': min(self.lengths), 'max': max(self.lengths),
+                 'mean': sum(length * n for length, n in self.lengths.items()) / count}
+        quantiles = [(0.5, 'p50'), (0.9, 'p90'), (0.99, 'p99')]
+        seen = 0
+        for length in sorted(self.lengths):
+            seen += self.lengths[length]
+            while quantiles and seen >= quantiles[0][0] * count:
+                stats[quantiles.pop(0)[1]] = length
+        return stats
+
+    def save(self, path):
+        meta = {'version': META_VERSION, 'schema_version': self.schema_version or 0,
+                'num_examples': self.num_examples, 'num_queries': len(self.query_ids),
+                'token_lengths': self._length_stats()}
+        with open(meta_path(path), 'w') as writer:
+            json.dump(meta, writer, indent=2)
+        return meta
+
+
+class RecordWriter(object):
+    """ tf.io.TFRecordWriter of path, compression None, 'GZIP' or 'ZLIB'.
+        With meta, the DatasetMeta of the records is saved on close """
+
+    def __init__(self, path, compression=None, meta=True):
+        self.path = path
+        self.meta = DatasetMeta() if meta else None
+        self._writer = tf.io.TFRecordWriter(path, tf.io.TFRecordOptions(compression_type=compression or ''))
+
+    def write(self, record, query_id=None, num_tokens=None, version=0):
+        if self.meta is not None:
+            self.meta.add(query_id, num_tokens, version)
+        self._writer.write(record)
+
+    def close(self):
+        self._writer.close()
+        if self.meta is not None:
+            self.meta.save(self.path)
+
+
+def manifest_path(path):
+    return path if path.endswith(MANIFEST_SUFFIX) else path + MANIFEST_SUFFIX
+
+
+def _read_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(buf, start, end):
+    """ yields the (field number, wire type, value) of a message, the value of a length delimited field is its (start, end) """
+    pos = start
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            value = buf[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f'unsupported protobuf wire type {wire_type}')
+        yield number, wire_type, value
+
+
+def example_feature(record, name):
+    """ the value of a feature of a serialized tf.train.Example without tensorflow: the list of bytes
+        of a bytes_list or the list of int64 of an int64_list, None if the example has no such feature """
+    key = name.encode()
+    features = next((value for number, _, value in _fields(record, 0, len(record)) if number == 1), None)
+    if features is None:
+        return None
+    for number, _, (start, end) in _fields(record, *features):
+        if number != 1:
+            continue
+        entry = dict((n, v) for n, _, v in _fields(record, start, end))
+        if 1 not in entry or record[entry[1][0]:entry[1][1]] != key:
+            continue
+        if 2 not in entry:
+            return None
+        for kind, _, (list_start, list_end) in _fields(record, *entry[2]):
+            values = []
+            for _, wire_type, value in _fields(record, list_start, list_end):
+                if kind == 1:
+                    values.append(bytes(record[value[0]:value[1]]))
+                elif wire_type == 2: # packed int64
+                    pos = value[0]
+                    while pos < value[1]:
+                        item, pos = _read_varint(record, pos)
+                        values.append(item - (1 << 64) if item >= 1 << 63 else item)
+                else:
+                    values.append(value - (1 << 64) if value >= 1 << 63 else value)
+            return values
+        return []
+    return None
+
+
+def index_records(path, verify=False):
+    """ the byte offsets of the records of an uncompressed TFRecord file, walking only the length
+        headers (the data crc is not read). Returns an int64 array of the offsets of the records and
+        of the end of the file, record n is the bytes offsets[n]:offsets[n + 1] with its framing """
+    offsets = array.array('q')
+    if os.path.getsize(path) == 0:
+        return np.zeros(1, dtype=np.int64)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        size, pos = len(buf), 0
+        while pos < size:
+            if pos + 12 > size:
+                raise ValueError(f'{path}: truncated record header at byte {pos}')
+            (length,) = struct.unpack_from('<Q', buf, pos)
+            if verify and struct.unpack_from('<I', buf, pos + 8)[0] != masked_crc32c(buf[pos:pos + 8]):
+                raise ValueError(f'{path}: corrupted length of the record at byte {pos}')
+            offsets.append(pos)
+            pos += length + RECORD_OVERHEAD
+        if pos != size:
+            raise ValueError(f'{path}: truncated last record at byte {offsets[-1]}')
+    offsets.append(size)
+    return np.frombuffer(offsets, dtype=np.int64)
+
+
+def build_record_index(path, query_ids=None, query_feature='q_id', verify=False, offsets=None):
+    """ indexes the records of path and saves path.index.npz: the record offsets (index_records if
+        not given) and the query boundaries (record number where each query starts). The query id of
+        each record comes from query_ids (a list, e.g. the query_pass_ids tsv of the document handles)
+        or else from the query_feature of the records (passage handles), read from the record bytes."""
+    if offsets is None:
+        offsets = index_records(path, verify)
+    num_records = len(offsets) - 1
+    if query_ids is None and num_records > 0:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            first = example_feature(buf[offsets[0] + 12:offsets[1] - 4], query_feature)
+            if first is not None:
+                query_ids = [example_feature(buf[start + 12:end - 4], query_feature)[0]
+                             for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+                query_ids = [value.decode() if isinstance(value, bytes) else str(value) for value in query_ids]
+    query_starts, queries = [], []
+    if query_ids is not None:
+        if len(query_ids) != num_records:
+            raise ValueError(f'{len(query_ids)} query ids for {num_records} records')
+        for n, query_id in enumerate(query_ids):
+            if not queries or query_id != queries[-1]:
+                query_starts.append(n)
+                queries.append(query_id)
+    np.savez(path + INDEX_SUFFIX, offsets=offsets, query_starts=np.array(query_starts, dtype=np.int64),
+             queries=np.array(queries, dtype=str))
+    return RecordIndex(path)
+
+
+class RecordIndex(object):
+    """ The offsets and query boundaries of the records of a TFRecord file (build_record_index):
+        reads record n with a seek and splits the file in byte ranges of whole records (or queries)
+        for parallel readers """
+
+    def __init__(self, path):
+        self.path = path
+        index = np.load(path + INDEX_SUFFIX)
+        self.offsets = index['offsets']
+        self.query_starts = index['query_starts']
+        self.queries = index['queries'].tolist()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read(self, n):
+        """ the serialized example of record n """
+        start, end = int(self.offsets[n]), int(self.offsets[n + 1])
+        with open(self.path, 'rb') as f:
+            f.seek(start + 12)
+            return f.read(end - start - RECORD_OVERHEAD)
+
+    def query_records(self, query_id):
+        """ the (first, end) record numbers of a query """
+        q = self.queries.index(query_id)
+        end = self.query_starts[q + 1] if q + 1 < len(self.queries) else len(self)
+        return int(self.query_starts[q]), int(end)
+
+    def byte_ranges(self, num_splits, by_query=True):
+        """ num_splits (start byte, end byte, first record, number of records) ranges of about the same
+            size, starting on a record boundary, or on a query boundary with by_query if the index has queries """
+        boundaries = self.query_starts if by_query and len(self.queries) else np.arange(len(self))
+        boundary_offsets = self.offsets[boundaries]
+        size = self.offsets[-1]
+        targets = [size * i // num_splits for i in range(num_splits)]
+        firsts = sorted(set(int(boundaries[min(np.searchsorted(boundary_offsets, target), len(boundaries) - 1)])
+                            for target in targets)) if len(boundaries) else []
+        ranges = []
+        for i, first in enumerate(firsts):
+            end = firsts[i + 1] if i + 1 < len(firsts) else len(self)
+            ranges.append((int(self.offsets[first]), int(self.offsets[end]), first, end - first))
+        return ranges
+
+
+def iter_records(path, start=0, end=None):
+    """ yields the serialized examples of the byte range start:end (record boundaries) of a TFRecord file """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while end is None or pos < end:
+            header = f.read(12)
+            if len(header) < 12:
+                return
+            (length,) = struct.unpack_from('<Q', header)
+            yield f.read(length)
+            f.read(4)
+            pos += length + RECORD_OVERHEAD
+
+
+def meta_path(path):
+    if path.endswith(MANIFEST_SUFFIX):
+        path = path[:-len(MANIFEST_SUFFIX)]
+    return path if path.endswith(META_SUFFIX) else path + META_SUFFIX
+
+
+def read_meta(path):
+    """ the DatasetMeta saved with the dataset of path (file or manifest), None for the datasets written without it """
+    path = meta_path(path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_manifest(path):
+    """ the manifest of a sharded dataset, path is the manifest or the dataset path given to the
+        writer. None if there is no manifest (a single TFRecord file) """
+    path = manifest_path(path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def open_tfrecord_writer(path, shard_size=None, shard_bytes=None, compression=None):
+    """ a RecordWriter of path, or a ShardedTFRecordWriter if the dataset is sharded or compressed """
+    if shard_size is None and shard_bytes is None and compression is None:
+        return RecordWriter(path)
+    return ShardedTFRecordWriter(path, shard_size, shard_bytes, compression)
+
+
+def write_record(tf_writer, record, query_id=None, num_tokens=None, version=0):
+    """ writes a serialized example, the query id, input length and record schema version go to the
+        metadata (and manifest) of a RecordWriter / ShardedTFRecordWriter """
+    if isinstance(tf_writer, (RecordWriter, ShardedTFRecordWriter)):
+        tf_writer.write(record, query_id, num_tokens, version)
+    else:
+        tf_writer.write(record)
+
+
+def tfrecord_dataset(path, num_parallel_reads=4):
+    """ the records of a TFRecord file, or of the shards of a manifest read with a deterministic
+        parallel interleave. Returns the dataset and the number of examples of the metadata or of
+        the manifest (None if the dataset has neither, the records have to be counted) """
+    meta = read_meta(path)
+    num_examples = meta['num_examples'] if meta is not None else None
+    manifest = read_manifest(path)
+    if manifest is None:
+        return tf.data.TFRecordDataset([path]), num_examples
+    root = os.path.dirname(manifest_path(path))
+    paths = [os.path.join(root, shard['path']) for shard in manifest['shards']]
+    if not paths:
+        raise ValueError(f'the manifest {manifest_path(path)} lists no shards')
+    compression = manifest['compression'] or ''
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    dataset = dataset.interleave(lambda shard: tf.data.TFRecordDataset(shard, compression_type=compression),
+                                 cycle_length=min(num_parallel_reads, len(paths)),
+                                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset, manifest['num_examples'] if num_examples is None else num_examples
+
+
+class ShardedTFRecordWriter(object):
+    """ Writes the records in shards path-00000, path-00001 ... and the manifest path.manifest.json
+        (shards, their number of examples and first / last query id) on close.
+        A new shard is started when the current one has shard_size examples or shard_bytes bytes
+        (uncompressed), at a query boundary: the candidates of a query stay in the same shard.
+        The DatasetMeta of all the shards is saved in path.meta.json """
+
+    def __init__(self, path, shard_size=None, shard_bytes=None, compression=None):
+        if compression is not None:
+            compression = compression.upper()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'compression must be in {COMPRESSIONS}, got {compression!r}')
+        self.path = path
+        self.shard_size = shard_size
+        self.shard_bytes = shard_bytes
+        self.compression = compression
+        self.shards = []
+        self.meta = DatasetMeta()
+        self._writer = None
+
+    def _is_full(self):
+        shard = self.shards[-1]
+        return ((self.shard_size is not None and shard['num_examples'] >= self.shard_size) or
+                (self.shard_bytes is not None and shard['num_bytes'] >= self.shard_bytes))
+
+    def _new_shard(self):
+        if self._writer is not None:
+            self._writer.close()
+        path = '{}-{:05d}'.format(self.path, len(self.shards))
+        self._writer = RecordWriter(path, self.compression, meta=False)
+        self.shards.append({'path': os.path.basename(path), 'num_examples': 0, 'num_bytes': 0,
+                            'first_query_id': None, 'last_query_id': None})
+
+    def write(self, record, query_id=None, num_tokens=None, version=0):
+        self.meta.add(query_id, num_tokens, version)
+        if self._writer is None or (self._is_full() and (query_id is None or query_id != self.shards[-1]['last_query_id'])):
+            self._new_shard()
+        self._writer.write(record)
+        shard = self.shards[-1]
+        shard['num_examples'] += 1
+        shard['num_bytes'] += len(record) + RECORD_OVERHEAD
+        if query_id is not None:
+            if shard['first_query_id'] is None:
+                shard['first_query_id'] = query_id
+            shard['last_query_id'] = query_id
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        manifest = {'version': MANIFEST_VERSION, 'compression': self.compression,
+                    'num_examples': sum(shard['num_examples'] for shard in self.shards), 'shards': self.shards}
+        with open(manifest_path(self.path), 'w') as writer:
+            json.dump(manifest, writer, indent=2)
+        self.meta.save(self.path)
+        print('wrote {} examples in {} shards, manifest {}'.format(
+            manifest['num_examples'], len(self.shards), manifest_path(self.path)))
@@ -0,0 +1,275 @@
+import argparse
+import subprocess
+import sys
+import time
+
+from Processors.processor_utils import strip_html_xml_tags, strip_html_xml_tags_bs4, clean_text
+
+
+def _read_columns(path, columns, max_lines):
+    rows = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if i >= max_lines:
+                break
+            fields = line.rstrip('\n').split('\t')
+            rows.append(tuple(fields[c] for c in columns))
+    return rows
+
+
+def _read_column(path, column, max_lines):
+    return [row[0] for row in _read_columns(path, (column,), max_lines)]
+
+
+def _seconds(fn):
+    start_time = time.time()
+    fn()
+    return time.time() - start_time
+
+
+def _docs_per_sec(fn, texts):
+    start_time = time.time()
+    for text in texts:
+        fn(text)
+    return len(texts) / max(time.time() - start_time, 1e-9)
+
+
+def bench_strip_html(args):
+    """ differential check of strip_html_xml_tags against the BeautifulSoup implementation
+        on a sample of a collection (MS MARCO, Robust04, CORD-19 ...) and per document speedup """
+    texts = _read_column(args.data_path, args.column, args.max_lines)
+    mismatches = 0
+    for text in texts:
+        if clean_text(strip_html_xml_tags(text)) != clean_text(strip_html_xml_tags_bs4(text)):
+            mismatches += 1
+            if mismatches <= 5:
+                print('mismatch: {}'.format(text[:200]))
+    fast = _docs_per_sec(strip_html_xml_tags, texts)
+    slow = _docs_per_sec(strip_html_xml_tags_bs4, texts)
+    print(f'{len(texts)} docs, {mismatches} mismatches')
+    print(f'bs4: {slow:.1f} docs/sec, fast: {fast:.1f} docs/sec, speedup x{fast / slow:.1f}')
+    return mismatches == 0
+
+
+def _reference_mark(marker, strategy, query, doc, title=None):
+    """ the per token marking loop the markers used before the lexicon kernel: linear scan of the
+        query stems, stemming of every token and rebuild of a spacy Doc. With a title, returns the
+        marked (query, title, doc), the query terms matched in the title or the doc are marked """
+    from spacy.tokens import Doc
+    nlp, stem = marker.nlp, marker.stem
+    q = nlp(query)
+    stem_to_id, id_to_pos = {}, {}
+    for pos, token in enumerate(q):
+        if not (token.is_punct or token.is_stop):
+            s = stem(token.text.lower())
+            if s not in stem_to_id:
+                stem_to_id[s] = len(stem_to_id)
+            id_to_pos.setdefault(stem_to_id[s], []).append(pos)
+    mu = strategy.startswith('mu')
+    mark = set()
+
+    def mark_terms(text):
+        d = nlp(text)
+        marked = []
+        for term in d:
+            marked.append(term.text)
+            if not (term.is_punct or term.is_stop):
+                s = stem(term.text.lower())
+                for q_stem in stem_to_id:
+                    if q_stem == s:
+                        q_i = stem_to_id[s]
+                        mark.add(q_i)
+                        marked[-1] = f"[e{q_i}]{term.text}[\\e{q_i}]" if mu else f"#{term.text}#"
+                        break
+        return ''.join(token.text_with_ws for token in Doc(nlp.vocab, words=marked, spaces=[token.whitespace_ for token in d]))
+
+    marked_title = mark_terms(title) if title is not None else None
+    marked_doc = mark_terms(doc)
+    marked_q = [token.text for token in q]
+    if strategy.endswith('pair'):
+        for q_i in mark:
+            for pos in id_to_pos[q_i]:
+                marked_q[pos] = f"[e{q_i}]{marked_q[pos]}[\\e{q_i}]" if mu else f"#{marked_q[pos]}#"
+    qu = Doc(nlp.vocab, words=marked_q, spaces=[token.whitespace_ for token in q])
+    marked_query = ''.join(token.text_with_ws for token in qu)
+    if title is not None:
+        return marked_query, marked_title, marked_doc
+    return marked_query, marked_doc
+
+
+def bench_mark(args):
+    """ differential check of the markers against the per token reference loop on a sample of
+        (query, doc) pairs and docs/sec of each strategy """
+    from Processors.marker_utils import STRATEGIES, get_marker
+    pairs = _read_columns(args.data_path, (args.query_column, args.column), args.max_lines)
+    ok = True
+    for strategy in STRATEGIES:
+        if strategy == 'base':
+            continue
+        marker = get_marker(strategy)
+        mismatches = 0
+        for query, doc in pairs:
+            if marker.mark(query, doc) != _reference_mark(marker, strategy, query, doc):
+                mismatches += 1
+                if mismatches <= 5:
+                    print('mismatch: {} | {}'.format(query, doc[:200]))
+        slow = len(pairs) / max(_seconds(lambda: [_reference_mark(marker, strategy, q, d) for q, d in pairs]), 1e-9)
+        fast = len(pairs) / max(_seconds(lambda: [marker.mark(q, d) for q, d in pairs]), 1e-9)
+        print(f'{strategy}: {len(pairs)} pairs, {mismatches} mismatches')
+        print(f'{strategy}: before: {slow:.1f} docs/sec, after: {fast:.1f} docs/sec, speedup x{fast / slow:.1f}')
+        ok = ok and mismatches == 0
+    return ok
+
+
+def _reference_ids(tokenizer, handle, query, doc):
+    """ the ids the handles wrote before the batched encoding, one encode call of the slow
+        tokenizer per marked string: (query ids, title ids, doc ids) with the document handles """
+    def encode(text, add_special_tokens=True, max_length=None):
+        return tokenizer.encode(str(text), add_special_tokens=add_special_tokens, max_length=max_length,
+                                truncation=max_length is not None)
+    if hasattr(handle, 'max_title_length'):
+        title, doc = doc
+        return (encode(query, max_length=handle.max_query_length),
+                encode(title, False, handle.max_title_length - 1), encode(doc, False))
+    return encode(query, max_length=handle.max_seq_length), encode(doc, max_length=handle.max_seq_length)
+
+
+def bench_handles(args):
+    """ differential check of the token ids written by the handles (batched fast tokenizer,
+        marks inserted in the ids of the clean text) against one slow tokenizer call per
+        marked string, and examples/sec of each handle """
+    from transformers import AutoTokenizer
+    from Processors.marker_utils import get_marker
+    from Processors.processor_utils import PassageHandle, DocumentHandle, DocumentSplitterHandle
+    slow_tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_init, use_fast=False)
+    fast_tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_init, use_fast=True)
+    pairs = _read_columns(args.data_path, (args.query_column, args.column), args.max_lines)
+    marker = get_marker(args.strategy)
+    ok = True
+    for handle_class in (PassageHandle, DocumentHandle, DocumentSplitterHandle):
+        handle = handle_class(fast_tokenizer)
+        titled = handle_class is not PassageHandle
+        # the first words of the text as title for the document handles
+        items = [(query, ' '.join(doc.split()[:8]), doc) if titled else (query, doc) for query, doc in pairs]
+        marked = marker.mark_batch(items, marked_text=True)
+        examples = [(m[0], [tuple(m[1:]) if titled else m[1]], [0], str(i), [str(i)], 0) for i, m in enumerate(marked)]
+        written = []
+        if titled:
+            handle._write_eval_ids = lambda tf_writer, ids_writer, i_ids, q, titles, docs, *a: written.append((q, titles[0], docs[0])) or i_ids
+            write = lambda batch: handle.write_eval_examples(None, None, 0, batch)
+        else:
+            handle._write_eval_ids = lambda tf_writer, q, docs, *a: written.append((q, docs[0]))
+            write = lambda batch: handle.write_eval_examples(None, batch)
+        references = []
+        slow = len(examples) / max(_seconds(lambda: [references.append(_reference_ids(slow_tokenizer, handle, e[0], e[1][0]))
+                                                     for e in examples]), 1e-9)
+        fast = len(examples) / max(_seconds(lambda: [write(examples[i:i + args.batch_size])
+                                                     for i in range(0, len(examples), args.batch_size)]), 1e-9)
+        mismatches = sum(1 for ids, reference in zip(written, references) if tuple(ids) != reference)
+        name = handle_class.__name__
+        print(f'{name}: {len(examples)} examples, {mismatches} mismatches, {handle.encoder}')
+        print(f'{name}: before: {slow:.1f} examples/sec, after: {fast:.1f} examples/sec, speedup x{fast / slow:.1f}')
+        ok = ok and mismatches == 0 and len(written) == len(references)
+    return ok
+
+
+def _read_batches(dataset, num_batches):
+    return [({name: value.numpy() for name, value in features.items()}, labels.numpy())
+            for features, labels in dataset.take(num_batches)]
+
+
+def bench_pipeline(args):
+    """ batches of the vectorized input pipeline of PassageHandle (get_*_dataset(vectorized=True))
+        against the per record pipeline, and examples/sec of both """
+    import os
+    import tempfile
+    import numpy as np
+    from transformers import AutoTokenizer
+    from Processors.processor_utils import PassageHandle
+    from Processors.marker_utils import get_marker
+    from Processors.tfrecord_utils import RecordWriter
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_init, use_fast=True)
+    pairs = _read_columns(args.data_path, (args.query_column, args.column), args.max_lines)
+    marked = get_marker(args.strategy).mark_batch(pairs, marked_text=True)
+    ok = True
+    for compact in (False, True):
+        handle = PassageHandle(tokenizer, compact_records=compact)
+        path = os.path.join(tempfile.mkdtemp(), 'dataset.tf')
+        writer = RecordWriter(path)
+        handle.write_eval_examples(writer, [(q, [p], [i % 2], str(i), [str(i)], 1) for i, (q, p) in enumerate(marked)])
+        writer.close()
+        num_batches = -(-len(marked) // args.batch_size)
+        batches = {}
+        for vectorized in (False, True):
+            dataset, count = handle.get_eval_dataset(path, args.batch_size, vectorized=vectorized)
+            seconds = _seconds(lambda: _read_batches(dataset, num_batches))
+            batches[vectorized] = _read_batches(dataset, num_batches)
+            print(f"{'compact' if compact else 'int64'}: vectorized={vectorized}: {count / seconds:.1f} examples/sec")
+        mismatches = sum(1 for (features, labels), (v_features, v_labels) in zip(batches[False], batches[True])
+                         if not np.array_equal(labels, v_labels)
+                         or any(not np.array_equal(value, v_features[name]) for name, value in features.items()))
+        print(f"{'compact' if compact else 'int64'}: {len(batches[True])} batches, {mismatches} mismatches")
+        ok = ok and mismatches == 0 and len(batches[False]) == len(batches[True])
+    return ok
+
+
+HEAVY_MODULES = ('tensorflow', 'spacy', 'nltk', 'bs4', 'absl', 'transformers')
+
+_IMPORT_SCRIPT = """
+import sys, time
+start_time = time.time()
+import Processors, Processors.msmarco_passages, Processors.msmarco_documents, Processors.robust04, Processors.cord19
+print(time.time() - start_time)
+print(' '.join(m for m in {} if m in sys.modules))
+"""
+
+
+def bench_import(args):
+    """ import time of the Processors package in a fresh interpreter, fails if one of the heavy
+        dependencies is imported or if it takes more than --max_import_sec """
+    output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(HEAVY_MODULES)],
+                            stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').split('\n')
+    seconds, loaded = float(output[0]), output[1].split()
+    print(f'import Processors: {seconds:.3f} sec, heavy modules imported: {loaded or None}')
+    return not loaded and seconds <= args.max_import_sec
+
+
+TARGETS = {
+    "strip_html": bench_strip_html,
+    "mark": bench_mark,
+    "handles": bench_handles,
+    "pipeline": bench_pipeline,
+    "import": bench_import,
+}
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    ## Required parameters
+    parser.add_argument("--target", default=None, type=str, required=True,
+                            help=f"what to benchmark, in : {set(TARGETS.keys())}")
+    parser.add_argument("--data_path", default=None, type=str, required=False,
+                            help="a sample .tsv file of the collection / pairs.")
+    parser.add_argument("--column", default=-1, type=int, required=False,
+                            help="the column of the text in the .tsv file.")
+    parser.add_argument("--query_column", default=0, type=int, required=False,
+                            help="the column of the query in the .tsv file of pairs (mark).")
+    parser.add_argument("--max_lines", default=10000, type=int, required=False,
+                            help="number of lines of the sample used.")
+    parser.add_argument("--strategy", default='mu_mark_pair', type=str, required=False,
+                            help="the marking strategy of the pairs (handles, pipeline).")
+    parser.add_argument("--tokenizer_init", default='bert-base-uncased', type=str, required=False,
+                            help="path to the tokenizer or name in transformers (handles, pipeline).")
+    parser.add_argument("--batch_size", default=1000, type=int, required=False,
+                            help="number of examples written together by the handles (handles), batch size of the datasets (pipeline).")
+    parser.add_argument("--max_import_sec", default=0.5, type=float, required=False,
+                            help="the import target fails above this import time of Processors.")
+    args = parser.parse_args()
+
+    ok = TARGETS[args.target](args)
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
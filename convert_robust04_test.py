@@ -19,9 +19,19 @@ def main():
                             help="create a sentence split output.")
     parser.add_argument("--set_name", default=None, type=str, required=True,
                             help="set name.")
+    parser.add_argument("--index_collection", action="store_true",
+                            help="fetch the documents through an on-disk offset index (built once next to the collection) instead of loading the collection in memory.")
+    parser.add_argument("--run_docs_only", action="store_true",
+                            help="read the run first and only keep the candidate documents when loading the collection.")
+    parser.add_argument("--clean_cache_size", default=10000, type=int, required=False,
+                            help="number of cleaned documents kept in the LRU cache (0 to disable).")
+    parser.add_argument("--num_workers", default=1, type=int, required=False,
+                            help="number of processes converting the queries, the output keeps the run order.")
+    parser.add_argument("--min_score_ratio", default=None, type=float, required=False,
+                            help="drop the candidates with a first stage score (pred) below min_score_ratio * the best score of the query.")
     args = parser.parse_args()
     
-    convert_eval_dataset(args.output_folder, args.queries_path, args.run_path, args.collection_path, args.set_name, args.num_eval_docs, args.sentence_level)
+    convert_eval_dataset(args.output_folder, args.queries_path, args.run_path, args.collection_path, args.set_name, args.num_eval_docs, args.sentence_level, index_collection=args.index_collection, run_docs_only=args.run_docs_only, clean_cache_size=args.clean_cache_size, num_workers=args.num_workers, min_score_ratio=args.min_score_ratio)
               
 
 if __name__ == "__main__":
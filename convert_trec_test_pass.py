@@ -19,9 +19,17 @@ def main():
                             help="the number of documents retrieved per query.")
     parser.add_argument("--set_name", default='test', type=str, required=False,
                             help="set name.")
+    parser.add_argument("--index_collection", action="store_true",
+                            help="fetch the documents through an on-disk offset index (built once next to the collection) instead of loading the collection in memory.")
+    parser.add_argument("--run_docs_only", action="store_true",
+                            help="read the run first and only keep the candidate documents when loading the collection.")
+    parser.add_argument("--clean_cache_size", default=10000, type=int, required=False,
+                            help="number of cleaned documents kept in the LRU cache (0 to disable).")
+    parser.add_argument("--num_workers", default=1, type=int, required=False,
+                            help="number of processes converting the queries, the output keeps the run order.")
     args = parser.parse_args()
     
-    convert_eval_dataset(args.output_folder, args.qrels_path, args.queries_path, args.run_path, args.collection_path, args.set_name, args.num_eval_docs)
+    convert_eval_dataset(args.output_folder, args.qrels_path, args.queries_path, args.run_path, args.collection_path, args.set_name, args.num_eval_docs, index_collection=args.index_collection, run_docs_only=args.run_docs_only, clean_cache_size=args.clean_cache_size, num_workers=args.num_workers)
               
 
 if __name__ == "__main__":
@@ -1,15 +1,53 @@
-from Processors import MsMarcoDocumentProcessor, get_marker, DocumentHandle, DocumentSplitterHandle
-from transformers import BertTokenizer
+import argparse
+import os
+import time
+from Processors.tfrecord_utils import build_record_index, index_records, read_manifest
 
 
-marker = get_marker('un_mark_pair')
+def _read_query_ids(ids_path):
+    """ the query id of each record from the query_pass_ids tsv of the document handles (i_ids, qid, doc id ...) """
+    with open(ids_path) as f:
+        return [line.split('\t')[1] for line in f]
 
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-handle = DocumentHandle(tokenizer, 512)
-doc_processor = MsMarcoDocumentProcessor(handle,marker)
 
-eval_batch_size = 128
-filename = "/projets/iris/PROJETS/lboualil/workdata/msmarco-passage/MarkedBERT_large/My_MsMarco_TFRecord/trec/docs/sentence/un_mark_pair/dataset_test.tf"
-eval_dataset, num_eval_examples = doc_processor.get_eval_dataset(filename, eval_batch_size)
+def main():
 
-print(num_eval_examples)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+
+    ## Required parameters
+    parser.add_argument("--data_path", default=None, type=str, required=True,
+                            help="The tfrecord file, or the manifest of a sharded dataset (uncompressed).")
+    parser.add_argument("--write_index", action="store_true",
+                            help="save the record offsets and query boundaries of each file in <file>.index.npz.")
+    parser.add_argument("--ids_path", default=None, type=str, required=False,
+                            help="query_pass_ids_<set_name>.tsv of a document dataset, the query ids of the records (else read from the q_id feature).")
+    parser.add_argument("--verify", action="store_true",
+                            help="check the crc of the length header of each record.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    manifest = read_manifest(args.data_path)
+    if manifest is None:
+        paths = [args.data_path]
+    else:
+        if manifest['compression']:
+            raise ValueError('the records of compressed shards can not be indexed by byte offsets')
+        root = os.path.dirname(args.data_path)
+        paths = [os.path.join(root, shard['path']) for shard in manifest['shards']]
+    query_ids = _read_query_ids(args.ids_path) if args.ids_path else None
+
+    total = 0
+    for path in paths:
+        offsets = index_records(path, args.verify)
+        num_records = len(offsets) - 1
+        if args.write_index:
+            shard_query_ids = query_ids[total:total + num_records] if query_ids is not None else None
+            build_record_index(path, shard_query_ids, offsets=offsets)
+        total += num_records
+        if len(paths) > 1:
+            print(f'{path}: {num_records} records')
+    print(total)
+    print(f'counted in {time.time() - start_time:.2f} sec')
+
+if __name__ == "__main__":
+    main()
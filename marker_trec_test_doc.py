@@ -1,6 +1,7 @@
 import argparse
 from Processors import MsMarcoDocumentProcessor, get_marker, DocumentHandle, DocumentSplitterHandle
 from transformers import BertTokenizer, RobertaTokenizer, DistilBertTokenizer, AlbertTokenizer
+from transformers import BertTokenizerFast, RobertaTokenizerFast, DistilBertTokenizerFast, AlbertTokenizerFast
 
 
 MODEL_CLASSES = {
@@ -9,6 +10,12 @@ MODEL_CLASSES = {
     "distilbert": DistilBertTokenizer,
     "albert" : AlbertTokenizer,
 }
+FAST_MODEL_CLASSES = {
+    "bert": BertTokenizerFast,
+    "roberta":  RobertaTokenizerFast,
+    "distilbert": DistilBertTokenizerFast,
+    "albert" : AlbertTokenizerFast,
+}
 HANDLE = {
     "sentence" : DocumentHandle,
     "split" : DocumentSplitterHandle,
@@ -42,18 +49,39 @@ def main():
     parser.add_argument("--stride", default=192, type=int, required=False,
                             help="if split into overlapping chunks set this stride.")
 
+    parser.add_argument("--analysis_store", default=None, type=str, required=False,
+                            help="directory of the per document analysis (tokens, stems) reused by every query, built from data_path if it does not exist or was built from another file or analyzer.")
+    parser.add_argument("--mark_batch_size", default=1000, type=int, required=False,
+                            help="number of pairs marked together (tokenized with spacy nlp.pipe), the candidates of a query are kept in the same batch.")
+    parser.add_argument("--n_process", default=1, type=int, required=False,
+                            help="number of processes marking the batches of pairs, one pool for the whole dataset.")
+    parser.add_argument("--fast_tokenizer", action="store_true",
+                            help="use the rust tokenizer, the texts of a batch of pairs are tokenized together and the marks are inserted in the token ids of the clean text (bert wordpiece).")
+    parser.add_argument("--compact_markers", action="store_true",
+                            help="add the marks of the strategy to the tokenizer as single tokens, the vocabulary is saved in output_dir/marker_vocab.json.")
+    parser.add_argument("--shard_size", default=None, type=int, required=False,
+                            help="write the tfrecords in shards of shard_size examples, listed in dataset_<set_name>.tf.manifest.json.")
+    parser.add_argument("--shard_bytes", default=None, type=int, required=False,
+                            help="write the tfrecords in shards of about shard_bytes bytes (uncompressed).")
+    parser.add_argument("--compression", default=None, type=str, required=False,
+                            help="compression of the tfrecord shards : 'GZIP' or 'ZLIB'.")
+    parser.add_argument("--compact_records", action="store_true",
+                            help="write the compact records: uint16 token ids cut to the sequence budget and integer ids (the tokenizer vocabulary must fit in uint16).")
     args = parser.parse_args()
 
-    tokenizer_class = MODEL_CLASSES[args.tokenizer_model.lower()]
+    tokenizer_class = (FAST_MODEL_CLASSES if args.fast_tokenizer else MODEL_CLASSES)[args.tokenizer_model.lower()]
     tokenizer = tokenizer_class.from_pretrained(args.tokenizer_init)
 
     marker = get_marker(args.strategy.lower())
 
     handle_class = HANDLE[args.handle.lower()]
-    handle = handle_class(tokenizer, args.max_seq_len, args.max_query_len, args.max_title_len, args.chunk_size, args.stride)
+    handle = handle_class(tokenizer, args.max_seq_len, args.max_query_len, args.max_title_len, args.chunk_size, args.stride, args.compact_records)
+    if args.compact_markers:
+        handle.add_marker_tokens(args.strategy.lower(), args.output_dir)
     doc_processor = MsMarcoDocumentProcessor(handle,marker)
             
-    doc_processor.prepare_inference_dataset(args.data_path, args.output_dir,'test')
+    doc_processor.prepare_inference_dataset(args.data_path, args.output_dir,'test', analysis_store=args.analysis_store, batch_size=args.mark_batch_size, n_process=args.n_process,
+                                                shard_size=args.shard_size, shard_bytes=args.shard_bytes, compression=args.compression)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
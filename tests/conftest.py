@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts and notebooks run from the repository root, where Processors / Modeling are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("spacy")
+pytest.importorskip("nltk")
+
+from Processors.analysis_utils import is_store_valid, open_analysis_store, source_fingerprint
+
+DOCS = [("d1", ("Marked passages of the collection",)), ("d2", ("Another passage",))]
+
+
+def _source(tmp_path, text):
+    path = tmp_path / "pairs.tsv"
+    path.write_text(text)
+    return str(path)
+
+
+def test_store_is_reused_for_the_same_source(tmp_path):
+    source = _source(tmp_path, "d1\tMarked passages of the collection\nd2\tAnother passage\n")
+    store_dir = str(tmp_path / "store")
+    store = open_analysis_store(store_dir, DOCS, ("doc",), source_path=source)
+    assert len(store) == 2
+    assert is_store_valid(store_dir, ("doc",), source_fingerprint(source))
+    # the analyzer alone is checked when the source is unknown
+    assert is_store_valid(store_dir, ("doc",))
+    assert not is_store_valid(store_dir, ("title", "doc"), source_fingerprint(source))
+
+
+def test_stale_store_is_rebuilt(tmp_path):
+    source = _source(tmp_path, "d1\tMarked passages of the collection\nd2\tAnother passage\n")
+    store_dir = str(tmp_path / "store")
+    open_analysis_store(store_dir, DOCS, ("doc",), source_path=source)
+    _source(tmp_path, "d3\tA passage of another collection\n")
+    assert not is_store_valid(store_dir, ("doc",), source_fingerprint(source))
+    store = open_analysis_store(store_dir, [("d3", ("A passage of another collection",))], ("doc",), source_path=source)
+    assert "d3" in store and "d1" not in store
+
+
+def test_store_of_another_stemmer_is_stale(tmp_path):
+    source = _source(tmp_path, "d1\tMarked passages of the collection\n")
+    store_dir = str(tmp_path / "store")
+    open_analysis_store(store_dir, DOCS, ("doc",), source_path=source)
+    assert not is_store_valid(store_dir, ("doc",), source_fingerprint(source, stem=str.lower))
@@ -0,0 +1,31 @@
+import os
+import threading
+
+from Processors.collection_utils import CollectionIndex, build_collection_index, get_index_path
+
+
+def _collection(tmp_path, num_docs=2000):
+    path = tmp_path / "collection.tsv"
+    path.write_text("".join(f"d{i}\tdocument {i}\n" for i in range(num_docs)))
+    return str(path)
+
+
+def test_index_lookup(tmp_path):
+    path = _collection(tmp_path)
+    collection = CollectionIndex(path, lambda line: line.split('\t'))
+    assert len(collection) == 2000
+    assert collection['d1234'] == 'document 1234'
+    assert 'd2000' not in collection
+
+
+def test_concurrent_builds(tmp_path):
+    path = _collection(tmp_path, 50000)
+    threads = [threading.Thread(target=build_collection_index, args=(path,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(os.listdir(tmp_path)) == ["collection.tsv", os.path.basename(get_index_path(path))]
+    collection = CollectionIndex(path, lambda line: line.split('\t'))
+    assert len(collection) == 50000
+    assert collection['d49999'] == 'document 49999'
@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the tsv only scripts must not pay for these, they are imported on first use
+HEAVY_MODULES = ('tensorflow', 'spacy', 'nltk', 'bs4', 'absl', 'transformers')
+
+IMPORT_SCRIPT = """
+import json, sys
+import Processors, Processors.msmarco_passages, Processors.msmarco_documents, Processors.robust04, Processors.cord19
+import Processors.tfrecord_utils, Processors.analysis_utils, Processors.run_utils
+print(json.dumps({'loaded': [m for m in %r if m in sys.modules],
+                  'tf': repr(Processors.import_utils.tf)}))
+"""
+
+
+def _import_processors():
+    """ imports Processors in a fresh interpreter """
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT % (HEAVY_MODULES,)],
+                            stdout=subprocess.PIPE, check=True, cwd=ROOT)
+    return json.loads(output.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_modules():
+    result = _import_processors()
+    assert 'tensorflow' not in result['loaded']
+    assert result['loaded'] == []
+    assert 'not imported' in result['tf']
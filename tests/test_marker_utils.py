@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("spacy")
+pytest.importorskip("nltk")
+
+from benchmark_preprocessing import _reference_mark
+from Processors.marker_utils import STRATEGIES, get_marker
+
+MARKED_STRATEGIES = [strategy for strategy in STRATEGIES if strategy != 'base']
+
+PAIRS = [
+    ("what is the cost of running a marathon", "Running a marathon costs money: the running shoes, the races and the travel."),
+    ("what is the cost of running a marathon", "Marathons are run by runners, they don't cost much."),
+    ("cannot sleep at night", "If you can't sleep at night, try to sleep earlier. Nights are long!"),
+    ("effects of caffeine", "No match here at all."),
+    ("COVID-19 vaccine side effects", "The side-effects of the covid-19 vaccines are mild; vaccinated people rarely report effects."),
+    ("U.S. population 2020", "The population of the U.S. in 2020 was 331 million (U.S. census)."),
+    ("the and of", "the and of: only stopwords and punctuation."),
+    ("", "an empty query"),
+    ("an empty doc", ""),
+]
+TITLES = ["Marathon running costs", "Sleep", "", "Caffeine effects and side effects", "U.S. census 2020"]
+
+
+@pytest.mark.parametrize("strategy", MARKED_STRATEGIES)
+def test_mark(strategy):
+    marker = get_marker(strategy)
+    for query, doc in PAIRS:
+        assert marker.mark(query, doc) == _reference_mark(marker, strategy, query, doc)
+
+
+@pytest.mark.parametrize("strategy", MARKED_STRATEGIES)
+def test_mark_with_title(strategy):
+    marker = get_marker(strategy)
+    for i, (query, doc) in enumerate(PAIRS):
+        for title in (TITLES[i % len(TITLES)], TITLES[(i + 1) % len(TITLES)]):
+            assert marker.mark(query, title, doc) == _reference_mark(marker, strategy, query, doc, title)
+
+
+@pytest.mark.parametrize("strategy", MARKED_STRATEGIES)
+def test_mark_batch(strategy):
+    marker = get_marker(strategy)
+    items = PAIRS + [(query, TITLES[i % len(TITLES)], doc) for i, (query, doc) in enumerate(PAIRS)]
+    assert marker.mark_batch(items) == [marker.mark(*item) for item in items]
+    assert marker.mark_batch(items) == [_reference_mark(marker, strategy, item[0], item[-1], *item[1:-1]) for item in items]
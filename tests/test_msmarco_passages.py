@@ -0,0 +1,18 @@
+from Processors.msmarco_passages import convert_train_dataset
+
+
+def test_convert_train_dataset(tmp_path):
+    triples = tmp_path / "triples.tsv"
+    triples.write_text("what  is it\t<p>a positive</p>\tthe  negative\n"
+                       "second query\tanother positive\tanother negative\n")
+    convert_train_dataset(str(triples), str(tmp_path), None)
+    assert (tmp_path / "train_pairs.tsv").read_text().splitlines() == [
+        "what is it\ta positive\t1", "what is it\tthe negative\t0",
+        "second query\tanother positive\t1", "second query\tanother negative\t0"]
+
+
+def test_convert_empty_train_dataset(tmp_path):
+    triples = tmp_path / "triples.tsv"
+    triples.write_text("")
+    convert_train_dataset(str(triples), str(tmp_path), None)
+    assert (tmp_path / "train_pairs.tsv").read_text() == ""
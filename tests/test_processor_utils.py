@@ -0,0 +1,101 @@
+import pytest
+
+from Processors.processor_utils import PassageHandle, COMPACT_RECORD_VERSION, convert_document_dataset
+
+TOKENS = [[101, 2054, 102], [], [0, 65535, 256, 1], [101] * 9 + [102]]
+
+
+def _compact_handle():
+    handle = PassageHandle(None, max_seq_length=16, max_query_length=8)
+    handle.compact_records = True
+    return handle
+
+
+@pytest.mark.parametrize("batch", [TOKENS, [[], []], [TOKENS[2]], []])
+def test_batch_tokens_compact(batch):
+    tf = pytest.importorskip("tensorflow")
+    handle = _compact_handle()
+    tokens = tf.constant([handle._token_feature(ids) for ids in batch], dtype=tf.string)
+    ids = handle._batch_tokens(tokens, COMPACT_RECORD_VERSION)
+    assert ids.dtype == tf.int32
+    assert ids.to_list() == batch
+    assert [handle._decode_tokens(record, COMPACT_RECORD_VERSION).numpy().tolist() for record in tokens] == batch
+
+
+COLLECTION = {'d1': ('Title 1', '<p>first  document</p>'), 'd2': ('Title 2', 'second\ndocument'),
+              'd3': ('Title 3', 'third <b>document</b>')}
+DATA = {'q1': ('query  one', {'d2'}, ['d2', 'd3']), 'q2': ('query two', set(), ['d3'])}
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_convert_document_dataset(tmp_path, num_workers):
+    data = {query_id: (query, qrels, list(doc_ids)) for query_id, (query, qrels, doc_ids) in DATA.items()}
+    convert_document_dataset(data, COLLECTION, 'test', 3, str(tmp_path), sentence_level=False, num_workers=num_workers)
+    lines = (tmp_path / 'run_test_doc.tsv').read_text().splitlines()
+    assert lines == ['q1\td2\tquery one\tTitle 2\tsecond document\t1\t1',
+                     'q1\td3\tquery one\tTitle 3\tthird document\t0\t1',
+                     'q1\td1\tquery one\tTitle 1\tfirst document\t0\t1',
+                     'q2\td3\tquery two\tTitle 3\tthird document\t0\t0',
+                     'q2\td1\tquery two\tTitle 1\tfirst document\t0\t0',
+                     'q2\td1\tquery two\tTitle 1\tfirst document\t0\t0']
+
+
+def test_convert_document_dataset_without_padding(tmp_path):
+    data = {query_id: (query, qrels, list(doc_ids)) for query_id, (query, qrels, doc_ids) in DATA.items()}
+    convert_document_dataset(data, COLLECTION, 'test', 3, str(tmp_path), sentence_level=False, pad_docs=False)
+    lines = (tmp_path / 'run_test_doc.tsv').read_text().splitlines()
+    assert [line.split('\t')[:2] for line in lines] == [['q1', 'd2'], ['q1', 'd3'], ['q2', 'd3']]
+
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', '[', ']', '#', '\\', "'", '.', ',', 'e', '0', '1',
+         'the', 'cat', 'sat', 'on', 'mat', 'don', 't', 'can', '##not', 'run', '##ning', 'mark', '##ed', '##s', 'a', 'word']
+
+
+def _tokenizers(tmp_path):
+    transformers = pytest.importorskip("transformers")
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(VOCAB) + "\n")
+    return (transformers.BertTokenizerFast(vocab_file=str(vocab_file)),
+            transformers.BertTokenizer(vocab_file=str(vocab_file)))
+
+
+def _marked_texts():
+    from Processors.marker_utils import MarkedText
+    e0 = ('[e0]', '[\\e0]')
+    e1 = ('[e1]', '[\\e1]')
+    fused = [MarkedText("the cat sat on the mat.", ((4, 7) + e0, (19, 22, '#', '#'))),
+             MarkedText("running marks, a word", ((0, 7) + e1, (8, 13) + e0)),
+             MarkedText("don't", ((0, 3) + e0, (4, 5) + e1)),
+             MarkedText("the mat", ()),
+             "the cat sat"]
+    fallback = [MarkedText("cannot run", ((0, 3) + e0,)),
+                MarkedText("the running cat", ((4, 7, '#', '#'), (12, 15) + e1)),
+                MarkedText("marked", ((0, 4) + e0,))]
+    return fused, fallback
+
+
+def _check_encoder(fast, slow):
+    from Processors.processor_utils import MarkEncoder
+    fused, fallback = _marked_texts()
+    encoder = MarkEncoder(fast)
+    assert encoder.fused
+    for text in fused + fallback:
+        assert encoder.encode(text) == slow.encode(str(text), add_special_tokens=False)
+    assert encoder.num_fallback == len(fallback)
+    assert encoder.num_fused == len(fused) - 1
+    texts = fused + fallback + fused
+    assert encoder.encode_batch(texts) == [slow.encode(str(text), add_special_tokens=False) for text in texts]
+
+
+def test_mark_encoder(tmp_path):
+    fast, slow = _tokenizers(tmp_path)
+    _check_encoder(fast, slow)
+
+
+def test_mark_encoder_compact_tokens(tmp_path):
+    fast, slow = _tokenizers(tmp_path)
+    marks = ['[e0]', '[\\e0]', '[e1]', '[\\e1]']
+    fast.add_tokens(marks)
+    slow.add_tokens(marks)
+    assert fast.encode('[e0]', add_special_tokens=False) == [len(VOCAB)]
+    _check_encoder(fast, slow)
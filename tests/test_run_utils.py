@@ -0,0 +1,26 @@
+import pytest
+
+from Processors.reader_utils import TsvSchema
+from Processors.run_utils import Run
+
+RUN_SCHEMA = TsvSchema(('query_id', 'doc_id', 'score', 'rank'))
+
+
+def _run(tmp_path, lines, **kwargs):
+    path = tmp_path / "run.tsv"
+    path.write_text("".join("\t".join(map(str, line)) + "\n" for line in lines))
+    return Run.from_file(str(path), RUN_SCHEMA, **kwargs)
+
+
+def test_cut_scores_positive(tmp_path):
+    run = _run(tmp_path, [("q1", "d1", 10.0, 1), ("q1", "d2", 6.0, 2), ("q1", "d3", 4.0, 3)], min_score_ratio=0.5)
+    assert list(run["q1"]) == ["d1", "d2"]
+
+
+@pytest.mark.parametrize("scores", [(-1.5, -3.0, -40.0), (0.0, -2.0, -5.0)])
+def test_cut_scores_keeps_queries_without_positive_score(tmp_path, scores):
+    lines = [("q1", f"d{i}", score, i) for i, score in enumerate(scores, 1)]
+    lines += [("q2", "d4", 8.0, 1), ("q2", "d5", 1.0, 2)]
+    run = _run(tmp_path, lines, min_score_ratio=0.5)
+    assert list(run["q1"]) == ["d1", "d2", "d3"]
+    assert list(run["q2"]) == ["d4"]
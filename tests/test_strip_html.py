@@ -0,0 +1,43 @@
+import json
+import os
+import warnings
+
+import pytest
+
+from Processors.processor_utils import clean_text, strip_html_xml_tags, strip_html_xml_tags_bs4
+
+pytest.importorskip("bs4")
+pytest.importorskip("lxml")
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "strip_html_corpus.jsonl")
+
+# the documented differences with BeautifulSoup + lxml: {document: text of strip_html_xml_tags}
+KNOWN_DIFFERENCES = {
+    "<p>Data<![CDATA[ raw <data> ]]> here</p>": "Data here",
+    "text with < lone bracket and </ closing": "text with < lone bracket and </ closing",
+}
+
+
+def _corpus():
+    with open(CORPUS) as f:
+        return [json.loads(line) for line in f]
+
+
+def _bs4_text(text):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return clean_text(strip_html_xml_tags_bs4(text))
+
+
+@pytest.mark.parametrize("text", _corpus())
+def test_same_text_as_bs4(text):
+    if text in KNOWN_DIFFERENCES:
+        assert clean_text(strip_html_xml_tags(text)) == KNOWN_DIFFERENCES[text]
+        assert _bs4_text(text) != KNOWN_DIFFERENCES[text]
+    else:
+        assert clean_text(strip_html_xml_tags(text)) == _bs4_text(text)
+
+
+def test_text_without_tags_is_unchanged():
+    text = "If x > 3 then y = 2; AT&T costs $5."
+    assert strip_html_xml_tags(text) == text
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from Processors.tfrecord_utils import (ShardedTFRecordWriter, RecordWriter, tfrecord_dataset, crc32c, _crc32c_python,
+                                       serialize_example, frame_record, example_feature, index_records, iter_records, read_meta)
+
+FEATURES = [
+    {'query_ids': [101, 2054, 2003, 102], 'doc_ids': np.array([101, 7592, 0, 102]), 'label': [1]},
+    {'q_id': b'1048585', 'd_id': [b'7187158'], 'label': [0], 'len_gt_titles': [2]},
+    {'titles': [b'a', b'', b'\xe2\x82\xac'], 'empty': [], 'ids': np.array([], dtype=np.int64)},
+    {'large': [2**63 - 1, 2**31, 300], 'negative': [-1, -2**63], 'tokens': np.arange(0, 70000, 7, dtype=np.int64)},
+    {'z': [1], 'a': [2], 'm': b'middle', 'B': [b'upper']},
+]
+
+
+def _protobuf_example():
+    """ the tf.train.Example proto classes built from their descriptor, without tensorflow """
+    pytest.importorskip('google.protobuf')
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    F = descriptor_pb2.FieldDescriptorProto
+    proto = descriptor_pb2.FileDescriptorProto(name='test_example.proto', package='tensorflow', syntax='proto3')
+    for name, value_type in (('BytesList', F.TYPE_BYTES), ('FloatList', F.TYPE_FLOAT), ('Int64List', F.TYPE_INT64)):
+        proto.message_type.add(name=name).field.add(name='value', number=1, type=value_type, label=F.LABEL_REPEATED)
+    feature = proto.message_type.add(name='Feature')
+    feature.oneof_decl.add(name='kind')
+    for number, name in enumerate(('bytes_list', 'float_list', 'int64_list'), 1):
+        feature.field.add(name=name, number=number, type=F.TYPE_MESSAGE, label=F.LABEL_OPTIONAL, oneof_index=0,
+                          type_name='.tensorflow.' + ''.join(word.title() for word in name.split('_')))
+    features = proto.message_type.add(name='Features')
+    entry = features.nested_type.add(name='FeatureEntry')
+    entry.options.map_entry = True
+    entry.field.add(name='key', number=1, type=F.TYPE_STRING, label=F.LABEL_OPTIONAL)
+    entry.field.add(name='value', number=2, type=F.TYPE_MESSAGE, label=F.LABEL_OPTIONAL, type_name='.tensorflow.Feature')
+    features.field.add(name='feature', number=1, type=F.TYPE_MESSAGE, label=F.LABEL_REPEATED,
+                       type_name='.tensorflow.Features.FeatureEntry')
+    proto.message_type.add(name='Example').field.add(name='features', number=1, type=F.TYPE_MESSAGE,
+                                                      label=F.LABEL_OPTIONAL, type_name='.tensorflow.Features')
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return {name: message_factory.GetMessageClass(pool.FindMessageTypeByName('tensorflow.' + name))
+            for name in ('Example', 'Features', 'Feature', 'BytesList', 'Int64List')}
+
+
+def _values(value):
+    if isinstance(value, bytes):
+        return [value]
+    return value.tolist() if isinstance(value, np.ndarray) else list(value)
+
+
+def test_crc32c():
+    assert crc32c(b'123456789') == 0xE3069283
+    assert _crc32c_python(b'123456789') == 0xE3069283
+    assert crc32c(b'') == _crc32c_python(b'') == 0
+
+
+def _example(feature):
+    """ the serialized tf.train.Example of a feature dict, built from the descriptor without tensorflow """
+    proto = _protobuf_example()
+    kinds = {}
+    for name, value in feature.items():
+        values = _values(value)
+        if values and isinstance(values[0], bytes):
+            kinds[name] = proto['Feature'](bytes_list=proto['BytesList'](value=values))
+        else:
+            kinds[name] = proto['Feature'](int64_list=proto['Int64List'](value=values))
+    return proto['Example'](features=proto['Features'](feature=kinds)).SerializeToString()
+
+
+@pytest.mark.parametrize('feature', FEATURES)
+def test_example_feature(feature):
+    record = _example(feature)
+    for name, value in feature.items():
+        assert example_feature(record, name) == _values(value)
+    assert example_feature(record, 'missing') is None
+
+
+def test_framed_records(tmp_path):
+    path = tmp_path / 'dataset.tf'
+    records = [_example(feature) for feature in FEATURES]
+    path.write_bytes(b''.join(frame_record(record) for record in records))
+    offsets = index_records(str(path), verify=True)
+    assert len(offsets) == len(records) + 1
+    assert list(iter_records(str(path))) == records
+    assert list(iter_records(str(path), int(offsets[1]), int(offsets[3]))) == records[1:3]
+
+
+def test_corrupted_length(tmp_path):
+    path = tmp_path / 'dataset.tf'
+    data = bytearray(frame_record(_example(FEATURES[0])))
+    data[0] ^= 1
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        index_records(str(path), verify=True)
+
+
+@pytest.mark.parametrize('feature', FEATURES)
+def test_serialize_example(feature):
+    tf = pytest.importorskip('tensorflow')
+    record = serialize_example(feature)
+    assert tf.train.Example.FromString(record) == tf.train.Example.FromString(_example(feature))
+
+
+def test_writer_framing(tmp_path):
+    pytest.importorskip('tensorflow')
+    path = str(tmp_path / 'dataset.tf')
+    records = [serialize_example(feature) for feature in FEATURES]
+    writer = RecordWriter(path)
+    for i, record in enumerate(records):
+        writer.write(record, query_id=str(i // 2), num_tokens=10)
+    writer.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(frame_record(record) for record in records)
+    assert list(iter_records(path)) == records
+    assert read_meta(path)['num_examples'] == len(records)
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError, match="compression must be in .*'LZ4'"):
+        ShardedTFRecordWriter(str(tmp_path / "dataset.tf"), shard_size=10, compression='lz4')
+
+
+def test_manifest_without_shards(tmp_path):
+    path = str(tmp_path / "dataset.tf")
+    ShardedTFRecordWriter(path, shard_size=10).close()
+    with pytest.raises(ValueError, match="lists no shards"):
+        tfrecord_dataset(path)